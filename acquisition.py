@@ -0,0 +1,132 @@
+"""Pipelined acquisition of the station sensors.
+
+Instead of a fixed wake tick followed by a read tick, each cycle is laid
+out from the sensors' own timings: the SDS011 fan is started first, the
+DHT11 is sampled while the fan spins up, and the PM reading is taken as
+soon as the warm-up ends. Everything else (LCD, MQTT) keeps running in the
+other uasyncio tasks meanwhile.
+
+In adaptive mode the warm-up is not fixed: the fan is stopped as soon as
+the PM readings converge, and the SDS011 warm-up time is only a cap.
+"""
+
+import uasyncio as asyncio
+import utime
+
+
+class SensorTiming:
+    """Timings of a sensor, in ms.
+
+    :param warmup_ms: Time from power-up to the first reliable reading.
+    :param settle_ms: Time a reading takes to be available once requested.
+    :param min_interval_ms: Shortest time between two readings.
+    """
+
+    def __init__(self, warmup_ms=0, settle_ms=0, min_interval_ms=0):
+        self.warmup_ms = warmup_ms
+        self.settle_ms = settle_ms
+        self.min_interval_ms = min_interval_ms
+
+
+SDS011_TIMING = SensorTiming(warmup_ms=10000, settle_ms=20, min_interval_ms=1000)
+DHT11_TIMING = SensorTiming(settle_ms=25, min_interval_ms=1000)
+
+# Stopping the fan for less than this saves nothing worth a spin-up
+_MIN_FAN_OFF_MS = 5000
+_POLL_MS = 20
+_ADAPTIVE_POLL_MS = 200
+
+
+class Acquisition:
+    """Runs the acquisition cycle of a sds011 and a dht11 wrapper.
+
+    :param period_ms: Wanted time between two samples. It is stretched to
+        what the sensors allow.
+    :param adaptive: Stop the warm-up once PM readings converge.
+    """
+
+    def __init__(self, pm_sensor, dht_sensor, period_ms,
+                 pm_timing=SDS011_TIMING, dht_timing=DHT11_TIMING,
+                 adaptive=False):
+        self._pm_sensor = pm_sensor
+        self._dht_sensor = dht_sensor
+        self._pm_timing = pm_timing
+        self._dht_timing = dht_timing
+        self.adaptive = adaptive
+        self.plan(period_ms)
+        self.cycles = 0
+        self.overruns = 0
+        # Duration of the last cycle's PM read, from request to answer
+        self.read_ms = 0
+        # Fan-on time of the last adaptive warm-up
+        self.warmup_ms = None
+
+    def plan(self, period_ms):
+        """Work out the cycle: offsets, from the start of the cycle, at
+        which each sensor is handled, and whether the fan is stopped
+        between samples.
+        """
+        pm = self._pm_timing
+        dht = self._dht_timing
+        busy_ms = pm.warmup_ms + pm.settle_ms
+        self.period_ms = max(period_ms, pm.min_interval_ms,
+                             dht.min_interval_ms)
+        # With a short off time the fan just keeps running
+        self.cycle_fan = self.period_ms - busy_ms >= _MIN_FAN_OFF_MS
+        if not self.cycle_fan:
+            self.period_ms = max(self.period_ms, pm.settle_ms)
+        self.read_at = pm.warmup_ms if self.cycle_fan else 0
+        # DHT11 sampled so that both readings are ready together
+        self.dht_at = max(0, self.read_at + pm.settle_ms - dht.settle_ms)
+
+    async def _sleep_until(self, deadline):
+        delay = utime.ticks_diff(deadline, utime.ticks_ms())
+        if delay > 0:
+            await asyncio.sleep_ms(delay)
+
+    async def _fixed_cycle(self, start):
+        pm_sensor = self._pm_sensor
+        if self.cycle_fan:
+            pm_sensor.wake()
+        if self.dht_at <= self.read_at:
+            await self._sleep_until(utime.ticks_add(start, self.dht_at))
+            self._dht_sensor.read_temperature()
+
+        await self._sleep_until(utime.ticks_add(start, self.read_at))
+        requested = utime.ticks_ms()
+        pm_sensor.request_pm()
+        while pm_sensor.poll_pm() is None:
+            await asyncio.sleep_ms(_POLL_MS)
+        self.read_ms = utime.ticks_diff(utime.ticks_ms(), requested)
+        if self.cycle_fan:
+            pm_sensor.sleep()
+        if self.dht_at > self.read_at:
+            await self._sleep_until(utime.ticks_add(start, self.dht_at))
+            self._dht_sensor.read_temperature()
+
+    async def _adaptive_cycle(self):
+        # The fixed warm-up becomes the cap; the DHT11 is read right away
+        pm_sensor = self._pm_sensor
+        pm_sensor.start_adaptive(max_warmup_ms=self._pm_timing.warmup_ms)
+        self._dht_sensor.read_temperature()
+        while pm_sensor.poll_adaptive() is None:
+            await asyncio.sleep_ms(_ADAPTIVE_POLL_MS)
+        self.warmup_ms = pm_sensor.warmup_ms
+        pm_sensor.sleep()
+
+    async def run(self):
+        start = utime.ticks_ms()
+        if not self.cycle_fan:
+            self._pm_sensor.wake()
+        while True:
+            if self.adaptive and self.cycle_fan:
+                await self._adaptive_cycle()
+            else:
+                await self._fixed_cycle(start)
+
+            self.cycles += 1
+            start = utime.ticks_add(start, self.period_ms)
+            if utime.ticks_diff(start, utime.ticks_ms()) < 0:
+                self.overruns += 1
+                start = utime.ticks_ms()
+            await self._sleep_until(start)
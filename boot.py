@@ -1,5 +1,8 @@
 # This file is executed on every boot (including wake-boot from deepsleep)
 #import esp
 #esp.osdebug(None)
+import machine
 import webrepl
-webrepl.start()
+# Al despertar de deep sleep se va directo a main.py a muestrear
+if machine.reset_cause() != machine.DEEPSLEEP_RESET:
+    webrepl.start()
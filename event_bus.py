@@ -0,0 +1,98 @@
+"""Bounded event bus between the sensor wrappers and slow observers.
+
+The bus is itself an observer: update() copies the record into one bounded
+queue per subscriber and returns right away, so a sensor read never waits
+for the network or the display. Each subscriber is then served by its own
+consumer calling pump().
+"""
+
+from measurement import Measurement
+
+# Overflow policies
+DROP_OLDEST = 0
+DROP_NEWEST = 1
+
+
+class Subscription:
+    """Queue of one observer, preallocated as a ring of Measurement."""
+
+    def __init__(self, observer, depth, policy):
+        self.observer = observer
+        self.policy = policy
+        self._queue = tuple(Measurement() for _ in range(depth))
+        self._head = 0
+        # Lag counters
+        self.pending = 0
+        self.max_pending = 0
+        self.dropped = 0
+        self.delivered = 0
+
+    def put(self, measurement):
+        queue = self._queue
+        depth = len(queue)
+        if self.pending == depth:
+            self.dropped += 1
+            if self.policy == DROP_NEWEST:
+                return
+            self._head = (self._head + 1) % depth
+            self.pending -= 1
+        slot = queue[(self._head + self.pending) % depth]
+        slot.fields = 0
+        slot.merge(measurement)
+        self.pending += 1
+        if self.pending > self.max_pending:
+            self.max_pending = self.pending
+
+    def deliver(self, budget=1):
+        """Hand up to budget queued records to the observer.
+
+        Return the number delivered.
+        """
+        delivered = 0
+        queue = self._queue
+        while self.pending and delivered < budget:
+            slot = queue[self._head]
+            self._head = (self._head + 1) % len(queue)
+            self.pending -= 1
+            self.observer.update(slot)
+            delivered += 1
+        self.delivered += delivered
+        return delivered
+
+
+class EventBus:
+
+    def __init__(self, depth=4, policy=DROP_OLDEST):
+        self._depth = depth
+        self._policy = policy
+        self._subscriptions = []
+
+    def add_observer(self, observer, depth=None, policy=None):
+        subscription = Subscription(observer,
+                                    self._depth if depth is None else depth,
+                                    self._policy if policy is None else policy)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def remove_observer(self, observer):
+        self._subscriptions.remove(self.subscription(observer))
+
+    def subscription(self, observer):
+        for subscription in self._subscriptions:
+            if subscription.observer is observer:
+                return subscription
+        raise KeyError(observer)
+
+    def update(self, measurement):
+        for subscription in self._subscriptions:
+            subscription.put(measurement)
+
+    def pump(self, budget=1):
+        """Deliver up to budget records to every subscriber.
+
+        Return the number of records delivered.
+        """
+        delivered = 0
+        for subscription in self._subscriptions:
+            delivered += subscription.deliver(budget)
+        return delivered
@@ -0,0 +1,209 @@
+from array import array
+
+from measurement import Measurement, TEMP, HUM, PM25, PM10
+
+# Scale factor that makes the MAD a consistent estimator of the standard
+# deviation for normally distributed data
+_MAD_SCALE = 1.4826
+
+
+def _insert_sorted(values, count, value):
+    # Insert value in the first count (sorted) items of values
+    i = count
+    while i > 0 and values[i - 1] > value:
+        values[i] = values[i - 1]
+        i -= 1
+    values[i] = value
+
+
+def _remove_sorted(values, count, value):
+    # Remove one occurrence of value from the first count (sorted) items
+    i = 0
+    while i < count - 1 and values[i] != value:
+        i += 1
+    while i < count - 1:
+        values[i] = values[i + 1]
+        i += 1
+
+
+def _median_sorted(values, count):
+    mid = count // 2
+    if count & 1:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+class RunningMedian:
+    """Median of the last `size` samples.
+
+    The window is kept both in arrival order and sorted, in two fixed
+    array('f') buffers, so an update costs O(size) and allocates nothing.
+    """
+
+    def __init__(self, size=5):
+        self._size = size
+        self._window = array('f', [0.0] * size)
+        self._sorted = array('f', [0.0] * size)
+        self._count = 0
+        self._index = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    def median(self):
+        return _median_sorted(self._sorted, self._count)
+
+    def push(self, value):
+        """Add a sample to the window, dropping the oldest one if full."""
+        window = self._window
+        # Go through the array so that value gets its float32 rounding
+        old = window[self._index]
+        window[self._index] = value
+        value = window[self._index]
+        if self._count == self._size:
+            _remove_sorted(self._sorted, self._count, old)
+            self._count -= 1
+        _insert_sorted(self._sorted, self._count, value)
+        self._count += 1
+        self._index = (self._index + 1) % self._size
+
+    def update(self, value):
+        self.push(value)
+        return self.median()
+
+    def reset(self):
+        self._count = 0
+        self._index = 0
+
+    def dump(self):
+        """Return the window, oldest sample first."""
+        size = self._size
+        start = self._index - self._count
+        return [self._window[(start + i) % size] for i in range(self._count)]
+
+    def load(self, values):
+        self.reset()
+        for value in values:
+            self.push(value)
+
+
+class Hampel:
+    """Hampel outlier filter.
+
+    A sample further than `k` scaled median absolute deviations from the
+    median of the previous `size` samples is replaced by that median.
+    Samples always enter the window unchanged, so a lasting step in the
+    signal goes through once it fills half of the window. `min_deviation`
+    keeps a flat window (MAD of 0) from rejecting every small change.
+    """
+
+    def __init__(self, size=5, k=3.0, min_deviation=0.0):
+        self._k = k
+        self._min_deviation = min_deviation
+        self._window = RunningMedian(size)
+        self._deviations = array('f', [0.0] * size)
+
+    def update(self, value):
+        window = self._window
+        count = window.count
+        result = value
+        if count >= 3:
+            median = window.median()
+            # Median absolute deviation, sorted in place in the scratch
+            # buffer
+            deviations = self._deviations
+            values = window._sorted
+            for i in range(count):
+                _insert_sorted(deviations, i, abs(values[i] - median))
+            mad = _median_sorted(deviations, count)
+            threshold = max(self._k * _MAD_SCALE * mad, self._min_deviation)
+            if abs(value - median) > threshold:
+                result = median
+        window.push(value)
+        return result
+
+    def reset(self):
+        self._window.reset()
+
+    def dump(self):
+        return self._window.dump()
+
+    def load(self, values):
+        self._window.load(values)
+
+
+class ExpSmoothing:
+    """Exponential smoothing: y += alpha * (x - y)."""
+
+    def __init__(self, alpha=0.3):
+        self._alpha = alpha
+        self._value = None
+
+    def update(self, value):
+        if self._value is None:
+            self._value = value
+        else:
+            self._value += self._alpha * (value - self._value)
+        return self._value
+
+    def reset(self):
+        self._value = None
+
+    def dump(self):
+        return [] if self._value is None else [self._value]
+
+    def load(self, values):
+        self._value = values[0] if values else None
+
+
+class FilterStage:
+    """Observer placed between a sensor wrapper and its observers.
+
+    `filters` maps a field name ('temp', 'hum', 'pm25', 'pm10') to the
+    filter applied to it; other fields are forwarded unchanged. Filtered
+    values go to the stage's own Measurement record.
+    """
+
+    def __init__(self, filters):
+        self._filters = filters
+        self._observers = set()
+        self._measurement = Measurement()
+
+    def add_observer(self, observer):
+        self._observers.add(observer)
+
+    def remove_observer(self, observer):
+        self._observers.remove(observer)
+
+    def dump(self):
+        """Return the state of every filter, to be restored with load()."""
+        return {name: value_filter.dump()
+                for name, value_filter in self._filters.items()}
+
+    def load(self, state):
+        for name, values in state.items():
+            if name in self._filters:
+                self._filters[name].load(values)
+
+    def _filter(self, name, value):
+        value_filter = self._filters.get(name)
+        if value_filter is None:
+            return value
+        return value_filter.update(value)
+
+    def update(self, measurement):
+        filtered = self._measurement
+        filtered.merge(measurement)
+        fields = measurement.fields
+        if fields & TEMP:
+            filtered.temp = self._filter('temp', measurement.temp)
+        if fields & HUM:
+            filtered.hum = self._filter('hum', measurement.hum)
+        if fields & PM25:
+            filtered.pm25 = self._filter('pm25', measurement.pm25)
+        if fields & PM10:
+            filtered.pm10 = self._filter('pm10', measurement.pm10)
+        filtered.fields = fields
+        for observer in self._observers:
+            observer.update(filtered)
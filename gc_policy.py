@@ -0,0 +1,30 @@
+"""Garbage collection policy for the application.
+
+Drivers do not call gc.collect() themselves. The application calls
+GcPolicy.step() once per cycle (e.g. as a scheduler job) and a collection
+only runs when the free heap falls below a threshold.
+"""
+
+import gc
+
+
+class GcPolicy:
+    """
+    :param min_free: Free heap (bytes) below which step() collects.
+    """
+
+    def __init__(self, min_free=16384):
+        self._min_free = min_free
+        self.collections = 0
+        self.mem_free = gc.mem_free()
+
+    def step(self):
+        """Collect if the free heap is below min_free. Returns True if a
+        collection ran."""
+        self.mem_free = gc.mem_free()
+        if self.mem_free >= self._min_free:
+            return False
+        gc.collect()
+        self.collections += 1
+        self.mem_free = gc.mem_free()
+        return True
@@ -0,0 +1,71 @@
+"""CGRAM glyph cache for HD44780 custom characters.
+
+The controller has 8 CGRAM slots. GlyphCache remembers which glyph
+(keyed by its 8 row bytes) sits in each slot. A glyph is uploaded only
+when it is not there yet, into a free slot or the least recently used
+one, so several screen layouts can share the slots without uploading
+every glyph each time.
+"""
+
+SLOTS = 8
+
+
+class GlyphCache:
+    """
+    :param lcd: The `LcdApi` whose CGRAM is managed.
+    """
+
+    def __init__(self, lcd):
+        self._lcd = lcd
+        # glyph bytes -> slot
+        self._slots = {}
+        # Glyph in each slot (None if free) and when it was last used
+        self._glyphs = [None] * SLOTS
+        self._used = [0] * SLOTS
+        self._clock = 0
+        self.uploads = 0
+
+    def load(self, glyph):
+        """Return the character code (0-7) showing glyph, uploading it if
+        needed."""
+        return self.load_all((glyph,))[0]
+
+    def load_all(self, glyphs):
+        """Return the character codes for a screen's glyphs. None of them
+        evicts another one from the same call."""
+        if len(glyphs) > SLOTS:
+            raise ValueError('more than {} glyphs'.format(SLOTS))
+        self._clock += 1
+        clock = self._clock
+        keys = [bytes(glyph) for glyph in glyphs]
+        # Mark the glyphs already loaded first, so the new ones cannot
+        # evict them
+        for key in keys:
+            slot = self._slots.get(key)
+            if slot is not None:
+                self._used[slot] = clock
+        codes = []
+        for key in keys:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._evict()
+                self._lcd.custom_char(slot, key)
+                self.uploads += 1
+                self._slots[key] = slot
+                self._glyphs[slot] = key
+            self._used[slot] = clock
+            codes.append(slot)
+        return codes
+
+    def _evict(self):
+        # Free slot, or the least recently used one
+        used = self._used
+        slot = 0
+        for i in range(SLOTS):
+            if self._glyphs[i] is None:
+                return i
+            if used[i] < used[slot]:
+                slot = i
+        del self._slots[self._glyphs[slot]]
+        self._glyphs[slot] = None
+        return slot
@@ -1,5 +1,9 @@
 from i2c_lcd import I2cLcd
+from lcd.glyphs import GlyphCache
 from machine import Pin, SoftI2C
+from measurement import TEMP, HUM, PM25, PM10, CLOCK
+
+SPACE = 0x20
 
 class LCD1602:
    
@@ -7,48 +11,85 @@ class LCD1602:
         # Configurar el LCD
         i2c = SoftI2C(scl=Pin(scl), sda=Pin(sda), freq=freq)
         self._connection = I2cLcd(i2c, addr, rows, cols)
+        # caracteres propios cargados en la CGRAM
+        self._glyphs = GlyphCache(self._connection)
+        self._cols = cols
+        self._rows = rows
+        # Lo que muestra el LCD y lo que deberia mostrar, una celda por byte.
+        # update() dibuja en _frame y flush() envia solo lo que cambio
+        self._shadow = bytearray(b' ' * (cols * rows))
+        self._frame = bytearray(b' ' * (cols * rows))
+        self._view = memoryview(self._frame)
+        
+    def _render(self, col, row, text, width):
+        # Escribe text en el frame, completado con espacios o cortado a width
+        frame = self._frame
+        index = row * self._cols + col
+        for n in range(width):
+            frame[index + n] = ord(text[n]) if n < len(text) else SPACE
+        
+    def flush(self):
+        # Envia solo los tramos de celdas distintas a lo que muestra el LCD.
+        # Dos tramos separados por una celda se juntan: reescribirla cuesta
+        # lo mismo que el comando de direccion DDRAM que se ahorra
+        frame = self._frame
+        shadow = self._shadow
+        cols = self._cols
+        for row in range(self._rows):
+            base = row * cols
+            col = 0
+            while col < cols:
+                if frame[base + col] == shadow[base + col]:
+                    col += 1
+                    continue
+                start = col
+                end = col + 1
+                col += 1
+                while col < cols and col - end <= 1:
+                    if frame[base + col] != shadow[base + col]:
+                        end = col + 1
+                    col += 1
+                run = self._view[base + start:base + end]
+                # direccion DDRAM y caracteres en una sola transferencia I2C
+                self._connection.write_at(start, row, run)
+                shadow[base + start:base + end] = run
         
-    def update(self, temp=None, hum=None, pm25=None, pm10=None, hour=None, minute=None):
+    def update(self, measurement):
         # Lógica para mostrar la temperatura en la pantalla LCD 1602
+        fields = measurement.fields
                 
-        if (temp != None):
-            self._connection.move_to(13,0)
-            self._connection.putstr("{}".format(temp))
+        if (fields & TEMP):
+            self._render(13, 0, "{}".format(measurement.temp), 2)
         
-        if(hum != None):
-            self._connection.move_to(7,0)
-            self._connection.putstr("{}".format(hum))
+        if(fields & HUM):
+            self._render(7, 0, "{}".format(measurement.hum), 2)
                     
-        if(pm25 != None):
-            self._connection.move_to(5,1)
-            self._connection.putstr('   ')
-            self._connection.move_to(5,1)
-            self._connection.putstr("{}".format(round(pm25)))
+        if(fields & PM25):
+            self._render(5, 1, "{}".format(round(measurement.pm25)), 3)
             
-        if(pm10 != None):
-            self._connection.move_to(13,1)
-            self._connection.putstr('   ')
-            self._connection.move_to(13,1)
-            self._connection.putstr("{}".format(round(pm10)))
+        if(fields & PM10):
+            self._render(13, 1, "{}".format(round(measurement.pm10)), 3)
     
-        if(minute!= None):
-            self._connection.move_to(0,0)
-            self._connection.putstr("{:02d}".format(hour))
-            self._connection.move_to(3,0)
-            self._connection.putstr("{:02d}".format(minute))
+        if(fields & CLOCK):
+            self._render(0, 0, "{:02d}".format(measurement.hour), 2)
+            self._render(3, 0, "{:02d}".format(measurement.minute), 2)
+            
+        self.flush()
     
     def create_templeate(self, chars: dict,  char_position: dict, char_hex : list):
-        
-        [self._connection.custom_char(i, char) for i, char in enumerate(char_hex)]
+        # Los enteros de chars indican el caracter de char_hex a mostrar.
+        # Solo se cargan en la CGRAM los que no esten ya cargados
+        codes = self._glyphs.load_all(char_hex)
 
         self._connection.clear()
+        self._shadow[:] = self._frame[:] = b' ' * len(self._frame)
         
-        fila = 1
-        for char_element, pos_element in zip(chars, char_position):
-            for char, num_col in zip(chars[char_element], char_position[pos_element]):
-                self._connection.move_to(num_col, fila)
+        # 'fila0' va en la fila 0 y 'fila1' en la 1, las mismas que usa
+        # update(), para que los valores no pisen el templeate
+        for fila, key in enumerate(sorted(chars)):
+            for char, num_col in zip(chars[key], char_position[key]):
                 if (type(char)==int):
-                    self._connection.putchar(chr(char))
+                    self._render(num_col, fila, chr(codes[char]), 1)
                 else:
-                    self._connection.putstr(char)
-            fila = fila - 1
\ No newline at end of file
+                    self._render(num_col, fila, char, len(char))
+        self.flush()
@@ -1,5 +1,4 @@
 import utime
-import gc
 
 from lcd_api import LcdApi
 from machine import I2C
@@ -12,6 +11,17 @@ MASK_E  = 0x04       # P2
 SHIFT_BACKLIGHT = 3  # P3
 SHIFT_DATA      = 4  # P4-P7
 
+def _expand(buf, offset, bits, byte):
+    # The 4 PCF8574 bytes that send byte in 4-bit mode, each nibble latched
+    # on the falling edge of E. Returns the next offset
+    high = bits | (((byte >> 4) & 0x0f) << SHIFT_DATA)
+    low = bits | ((byte & 0x0f) << SHIFT_DATA)
+    buf[offset] = high | MASK_E
+    buf[offset + 1] = high
+    buf[offset + 2] = low | MASK_E
+    buf[offset + 3] = low
+    return offset + 4
+
 class I2cLcd(LcdApi):
     
     #Implements a HD44780 character LCD connected via PCF8574 on I2C
@@ -19,6 +29,11 @@ class I2cLcd(LcdApi):
     def __init__(self, i2c, i2c_addr, num_lines, num_columns):
         self.i2c = i2c
         self.i2c_addr = i2c_addr
+        # Bulk transfers: a command plus a full line per writeto. One view
+        # per length, so sending a partial buffer does not allocate
+        self._buf = bytearray(4 * (1 + num_columns))
+        view = memoryview(self._buf)
+        self._views = [view[:n] for n in range(len(self._buf) + 1)]
         self.i2c.writeto(self.i2c_addr, bytes([0]))
         utime.sleep_ms(20)   # Allow LCD time to powerup
         # Send reset 3 times
@@ -36,51 +51,53 @@ class I2cLcd(LcdApi):
         if num_lines > 1:
             cmd |= self.LCD_FUNCTION_2LINES
         self.hal_write_command(cmd)
-        gc.collect()
 
     def hal_write_init_nibble(self, nibble):
         # Writes an initialization nibble to the LCD.
         # This particular function is only used during initialization.
         byte = ((nibble >> 4) & 0x0f) << SHIFT_DATA
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        gc.collect()
+        self._buf[0] = byte | MASK_E
+        self._buf[1] = byte
+        self.i2c.writeto(self.i2c_addr, self._views[2])
         
     def hal_backlight_on(self):
         # Allows the hal layer to turn the backlight on
-        self.i2c.writeto(self.i2c_addr, bytes([1 << SHIFT_BACKLIGHT]))
-        gc.collect()
+        self._buf[0] = 1 << SHIFT_BACKLIGHT
+        self.i2c.writeto(self.i2c_addr, self._views[1])
         
     def hal_backlight_off(self):
         #Allows the hal layer to turn the backlight off
-        self.i2c.writeto(self.i2c_addr, bytes([0]))
-        gc.collect()
+        self._buf[0] = 0
+        self.i2c.writeto(self.i2c_addr, self._views[1])
         
     def hal_write_command(self, cmd):
         # Write a command to the LCD. Data is latched on the falling edge of E.
-        byte = ((self.backlight << SHIFT_BACKLIGHT) |
-                (((cmd >> 4) & 0x0f) << SHIFT_DATA))
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        byte = ((self.backlight << SHIFT_BACKLIGHT) |
-                ((cmd & 0x0f) << SHIFT_DATA))
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
+        _expand(self._buf, 0, self.backlight << SHIFT_BACKLIGHT, cmd)
+        self.i2c.writeto(self.i2c_addr, self._views[4])
         if cmd <= 3:
             # The home and clear commands require a worst case delay of 4.1 msec
             utime.sleep_ms(5)
-        gc.collect()
 
     def hal_write_data(self, data):
         # Write data to the LCD. Data is latched on the falling edge of E.
-        byte = (MASK_RS |
-                (self.backlight << SHIFT_BACKLIGHT) |
-                (((data >> 4) & 0x0f) << SHIFT_DATA))
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        byte = (MASK_RS |
-                (self.backlight << SHIFT_BACKLIGHT) |
-                ((data & 0x0f) << SHIFT_DATA))      
-        self.i2c.writeto(self.i2c_addr, bytes([byte | MASK_E]))
-        self.i2c.writeto(self.i2c_addr, bytes([byte]))
-        gc.collect()
\ No newline at end of file
+        _expand(self._buf, 0, MASK_RS | (self.backlight << SHIFT_BACKLIGHT), data)
+        self.i2c.writeto(self.i2c_addr, self._views[4])
+
+    def hal_write_bulk(self, cmd, data):
+        # Expands the command (if any) and the data into the preallocated
+        # buffer and sends it in one writeto, or one per full buffer.
+        # cmd must not be clear or home, which need a delay
+        buf = self._buf
+        size = len(buf)
+        bits = self.backlight << SHIFT_BACKLIGHT
+        offset = 0
+        if cmd is not None:
+            offset = _expand(buf, offset, bits, cmd)
+        bits |= MASK_RS
+        for byte in data:
+            if offset == size:
+                self.i2c.writeto(self.i2c_addr, buf)
+                offset = 0
+            offset = _expand(buf, offset, bits, byte)
+        if offset:
+            self.i2c.writeto(self.i2c_addr, self._views[offset])
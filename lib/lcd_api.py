@@ -56,6 +56,8 @@ class LcdApi:
             self.num_columns = 40
         self.cursor_x = 0
         self.cursor_y = 0
+        # DDRAM address the controller writes next (None if unknown)
+        self.hw_addr = None
         self.implied_newline = False
         self.backlight = True
         self.display_off()
@@ -73,6 +75,7 @@ class LcdApi:
         self.hal_write_command(self.LCD_HOME)
         self.cursor_x = 0
         self.cursor_y = 0
+        self.hw_addr = 0
 
     def show_cursor(self):
         """Causes the cursor to be made visible."""
@@ -122,15 +125,35 @@ class LcdApi:
     def move_to(self, cursor_x, cursor_y):
         """Moves the cursor position to the indicated position. The cursor
         position is zero based (i.e. cursor_x == 0 indicates first column).
+
+        No command is sent if the controller already points there, e.g.
+        after writing the previous character (entry increment mode).
         """
         self.cursor_x = cursor_x
         self.cursor_y = cursor_y
+        addr = self._address(cursor_x, cursor_y)
+        if addr != self.hw_addr:
+            self.hal_write_command(self.LCD_DDRAM | addr)
+            self.hw_addr = addr
+
+    def _written(self, count):
+        # The controller increments its address after every data write.
+        # Past the end of a DDRAM line it wraps to the other line, which
+        # is not tracked
+        if self.hw_addr is not None:
+            addr = self.hw_addr + count
+            if addr & 0x3f >= 0x28:
+                addr = None
+            self.hw_addr = addr
+
+    def _address(self, cursor_x, cursor_y):
+        # DDRAM address of a cursor position
         addr = cursor_x & 0x3f
         if cursor_y & 1:
             addr += 0x40    # Lines 1 & 3 add 0x40
         if cursor_y & 2:    # Lines 2 & 3 add number of columns
             addr += self.num_columns
-        self.hal_write_command(self.LCD_DDRAM | addr)
+        return addr
 
     def putchar(self, char):
         """Writes the indicated character to the LCD at the current cursor
@@ -145,6 +168,7 @@ class LcdApi:
                 self.cursor_x = self.num_columns
         else:
             self.hal_write_data(ord(char))
+            self._written(1)
             self.cursor_x += 1
         if self.cursor_x >= self.num_columns:
             self.cursor_x = 0
@@ -157,9 +181,57 @@ class LcdApi:
     def putstr(self, string):
         """Write the indicated string to the LCD at the current cursor
         position and advances the cursor position appropriately.
+
+        Characters up to the end of the line go to the hal in one bulk
+        write; newlines and wrapping behave as with putchar().
         """
-        for char in string:
-            self.putchar(char)
+        start = 0
+        length = len(string)
+        while start < length:
+            end = min(length, start + self.num_columns - self.cursor_x)
+            newline = string.find('\n', start, end)
+            if newline == start:
+                self.putchar('\n')
+                start += 1
+                continue
+            if newline > start:
+                end = newline
+            self.hal_write_bulk(None, bytes(map(ord, string[start:end])))
+            self._written(end - start)
+            self._advance(end - start)
+            start = end
+
+    def write_at(self, cursor_x, cursor_y, data):
+        """Write the data bytes (e.g. raw character codes) starting at the
+        indicated position. The address command and the data go to the hal
+        in one bulk write when they fit in the line.
+        """
+        if cursor_x + len(data) > self.num_columns:
+            self.move_to(cursor_x, cursor_y)
+            self.putstr(''.join(map(chr, data)))
+            return
+        self.cursor_x = cursor_x
+        self.cursor_y = cursor_y
+        addr = self._address(cursor_x, cursor_y)
+        if addr == self.hw_addr:
+            self.hal_write_bulk(None, data)
+        else:
+            self.hal_write_bulk(self.LCD_DDRAM | addr, data)
+        self.hw_addr = addr
+        self._written(len(data))
+        self._advance(len(data))
+
+    def _advance(self, count):
+        # Cursor bookkeeping after count characters written on one line,
+        # wrapping like putchar()
+        self.cursor_x += count
+        if self.cursor_x >= self.num_columns:
+            self.cursor_x = 0
+            self.cursor_y += 1
+            self.implied_newline = True
+        if self.cursor_y >= self.num_lines:
+            self.cursor_y = 0
+        self.move_to(self.cursor_x, self.cursor_y)
 
     def custom_char(self, location, charmap):
         """Write a character to one of the 8 CGRAM locations, available
@@ -167,6 +239,8 @@ class LcdApi:
         """
         location &= 0x7
         self.hal_write_command(self.LCD_CGRAM | (location << 3))
+        # The address counter now points to CGRAM
+        self.hw_addr = None
         self.hal_sleep_us(40)
         for i in range(8):
             self.hal_write_data(charmap[i])
@@ -203,6 +277,18 @@ class LcdApi:
         """
         raise NotImplementedError
 
+    def hal_write_bulk(self, cmd, data):
+        """Write an optional command (None to skip it) followed by a run of
+        data bytes.
+
+        A derived HAL class may override this to send them in a single
+        transfer. By default they are written one at a time.
+        """
+        if cmd is not None:
+            self.hal_write_command(cmd)
+        for byte in data:
+            self.hal_write_data(byte)
+
     def hal_sleep_us(self, usecs):
         """Sleep for some time (given in microseconds)."""
         time.sleep_us(usecs)
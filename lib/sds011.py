@@ -12,41 +12,183 @@ Reading format. See http://cl.ly/ekot
 8 Checksum Low byte of sum of DATA bytes
 9 Tail     '\xab'
 
+Command replies use the same layout with command '\xc5': DATA1 echoes
+the command ID and DATA2..DATA4 carry its parameters.
+
+Command format.
+
+0  Header   '\xaa'
+1  Command  '\xb4'
+2  DATA1    Command ID (see _SDS011_CMDS)
+3  DATA2    Get (0) / Set (1)
+4  DATA3    Command parameter
+5  DATA4 .. 14 DATA13  Reserved, except DATA12/13 = new ID for SET_ID
+15 DATA14   Target ID byte 1 (0xff broadcast)
+16 DATA15   Target ID byte 2 (0xff broadcast)
+17 Checksum Low byte of sum of DATA bytes
+18 Tail     '\xab'
+
 """
 
-import ustruct as struct
-import sys
+import utime
+
+_SDS011_CMDS = {'SET': 0x01,
+        'GET': 0x00,
+        'QUERY': 0x04,
+        'REPORTING_MODE': 0x02,
+        'SET_ID': 0x05,
+        'SLEEPWAKE': 0x06,
+        'FIRMWARE': 0x07,
+        'DUTYCYCLE': 0x08}
+
+_CMD_LEN = 19
+_BROADCAST_ID = 0xffff
+_MAX_WORKING_PERIOD = 30        # Minutes
+
+_FRAME_LEN = 10
+_RING_SIZE = 64                 # Must be a power of two
+_RING_MASK = _RING_SIZE - 1
+_READ_TIMEOUT_MS = 550          # 512 characters at 9600 bauds
+_ACTIVE_TIMEOUT_MS = 1100       # Sensor pushes a frame every second
+
+def _set_checksum(frame):
+    checksum = 0
+    for i in range(2, 17):
+        checksum += frame[i]
+    frame[17] = checksum & 0xff
+
+
+def _frame_checksum_ok(frame):
+    checksum = 0
+    for i in range(2, 8):
+        checksum += frame[i]
+    return (checksum & 0xff) == frame[8]
+
+
+def _command_frame(cmd, mode=0, param=0, device_id=_BROADCAST_ID):
+    frame = bytearray(_CMD_LEN)
+    frame[0] = 0xaa
+    frame[1] = 0xb4
+    frame[2] = cmd
+    frame[3] = mode
+    frame[4] = param
+    frame[15] = device_id >> 8
+    frame[16] = device_id & 0xff
+    _set_checksum(frame)
+    frame[18] = 0xab
+    return bytes(frame)
+
+
+def _build_frames(device_id):
+    """Build every fixed command frame for a device, so that sending a
+    command is a single uart.write of a cached buffer.
+    """
+    cmds = _SDS011_CMDS
+    return {
+        'QUERY': _command_frame(cmds['QUERY'], device_id=device_id),
+        'WAKE': _command_frame(cmds['SLEEPWAKE'], cmds['SET'], 1, device_id),
+        'SLEEP': _command_frame(cmds['SLEEPWAKE'], cmds['SET'], 0, device_id),
+        'GET_SLEEPWAKE': _command_frame(cmds['SLEEPWAKE'], cmds['GET'],
+                                        device_id=device_id),
+        'MODE_ACTIVE': _command_frame(cmds['REPORTING_MODE'], cmds['SET'], 0,
+                                      device_id),
+        'MODE_QUERY': _command_frame(cmds['REPORTING_MODE'], cmds['SET'], 1,
+                                     device_id),
+        'GET_MODE': _command_frame(cmds['REPORTING_MODE'], cmds['GET'],
+                                   device_id=device_id),
+        'FIRMWARE': _command_frame(cmds['FIRMWARE'], device_id=device_id),
+        'GET_DUTYCYCLE': _command_frame(cmds['DUTYCYCLE'], cmds['GET'],
+                                        device_id=device_id),
+        # One frame per working period, indexed by minutes (0 = continuous)
+        'DUTYCYCLE': tuple(_command_frame(cmds['DUTYCYCLE'], cmds['SET'], n,
+                                          device_id)
+                           for n in range(_MAX_WORKING_PERIOD + 1)),
+    }
+
+
+_BROADCAST_FRAMES = _build_frames(_BROADCAST_ID)
 
-_SDS011_CMDS = {'SET': b'\x01',
-        'GET': b'\x00',
-        'QUERY': b'\x04',
-        'REPORTING_MODE': b'\x02',
-        'DUTYCYCLE': b'\x08',
-        'SLEEPWAKE': b'\x06'}
 
 class SDS011:
     """A driver for the SDS011 particulate matter sensor.
 
     :param uart: The `UART` object to use.
+    :param active: Use active reporting mode (the sensor pushes a frame
+        every second) instead of query mode.
+    :param device_id: Send commands to this device ID only. By default
+        commands are broadcast.
     """
-    def __init__(self, uart):
+    def __init__(self, uart, active=False, device_id=None):
         self._uart = uart
-        self._pm25 = 0.0
-        self._pm10 = 0.0
+        self._active = active
+        self._pm25 = 0
+        self._pm10 = 0
+        self._device_id = device_id
         self._packet_status = False
-        self._packet = ()
+        self._fresh = False
+        self._deadline = 0
+
+        # Receive ring buffer. One view per start offset is built up front
+        # so that readinto() never has to slice (and allocate) at runtime.
+        self._ring = bytearray(_RING_SIZE)
+        ring_mv = memoryview(self._ring)
+        self._ring_views = tuple(ring_mv[i:] for i in range(_RING_SIZE))
+        self._head = 0
+        self._count = 0
+
+        # Last frame pulled out of the ring; packet is the part after the
+        # header and command bytes.
+        self._frame = bytearray(_FRAME_LEN)
+        self._packet = memoryview(self._frame)[2:]
+
+        # Last command reply ('\xc5' frame)
+        self._reply = bytearray(_FRAME_LEN)
+        self._reply_ready = False
+        self._duty_cycle = None
 
-        self.set_reporting_mode_query()
+        # Command frames, plus a scratch frame for parametric commands
+        self._frames = _BROADCAST_FRAMES
+        self._cmd_buf = bytearray(_command_frame(_SDS011_CMDS['SET_ID']))
+        self._target_id = _BROADCAST_ID
+        if device_id is not None:
+            self.set_target_id(device_id)
+
+        if active:
+            self.set_reporting_mode_active()
+        else:
+            self.set_reporting_mode_query()
+
+    @property
+    def active(self):
+        """Return True if the sensor is in active reporting mode."""
+        return self._active
 
     @property
     def pm25(self):
         """Return the PM2.5 concentration, in µg/m^3."""
-        return self._pm25
+        return self._pm25 / 10.0
 
     @property
     def pm10(self):
         """Return the PM10 concentration, in µg/m^3."""
-        return self._pm10
+        return self._pm10 / 10.0
+
+    @property
+    def device_id(self):
+        """Return the ID of the device, as reported by its last frame."""
+        return self._device_id
+
+    @property
+    def fresh(self):
+        """Return True if a measurement arrived since the last request()."""
+        return self._fresh
+
+    @property
+    def duty_cycle(self):
+        """Return the working period confirmed by the sensor, in minutes
+        (0 = continuous), or None if it has not been set.
+        """
+        return self._duty_cycle
 
     @property
     def packet_status(self):
@@ -59,74 +201,261 @@ class SDS011:
         return self._packet
 
     def make_command(self, cmd, mode, param):
-        header = b'\xaa\xb4'
-        padding = b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xff'
-        checksum = chr(( ord(cmd) + ord(mode) + ord(param) + 255 + 255) % 256)
-        checksum = bytes(checksum, 'utf8')
-        tail = b'\xab'
-
-        return header + cmd + mode + param + padding + checksum + tail
+        """Build a broadcast command frame. Frames for the commands the
+        driver sends itself are prebuilt at import time.
+        """
+        return _command_frame(cmd, mode, param)
 
     def wake(self):
         """Sends wake command to sds011 (starts its fan)."""
-        cmd = self.make_command(_SDS011_CMDS['SLEEPWAKE'],
-                _SDS011_CMDS['SET'], chr(1))
-        self._uart.write(cmd)
+        self._uart.write(self._frames['WAKE'])
 
     def sleep(self):
         """Sends sleep command to sds011 (stops its fan)."""
-        cmd = self.make_command(_SDS011_CMDS['SLEEPWAKE'],
-                _SDS011_CMDS['SET'], chr(0))
-        self._uart.write(cmd)
+        self._uart.write(self._frames['SLEEP'])
 
     def set_reporting_mode_query(self):
-        cmd = self.make_command(_SDS011_CMDS['REPORTING_MODE'],
-                _SDS011_CMDS['SET'], chr(1))
-        self._uart.write(cmd)
+        self._uart.write(self._frames['MODE_QUERY'])
+        self._active = False
+
+    def get_reporting_mode(self):
+        """Read back the reporting mode stored in the sensor.
+
+        Return True for active mode, False for query mode, or None if the
+        sensor does not answer.
+        """
+        self._reply_ready = False
+        self._uart.write(self._frames['GET_MODE'])
+        if not self._wait_reply(_SDS011_CMDS['REPORTING_MODE']):
+            return None
+        self._active = self._reply[4] == 0
+        return self._active
+
+    def set_reporting_mode_active(self):
+        """Make the sensor push a measurement every second on its own."""
+        self._uart.write(self._frames['MODE_ACTIVE'])
+        self._active = True
 
     def query(self):
         """Query new measurement data"""
-        cmd = self.make_command(_SDS011_CMDS['QUERY'], chr(0), chr(0))
-        self._uart.write(cmd)
+        self._uart.write(self._frames['QUERY'])
+
+    def query_firmware(self):
+        """Ask the sensor for its firmware version."""
+        self._uart.write(self._frames['FIRMWARE'])
+
+    def query_working_period(self):
+        """Ask the sensor for its current working period."""
+        self._uart.write(self._frames['GET_DUTYCYCLE'])
+
+    def set_working_period(self, minutes):
+        """Set the working period, in minutes (0 = continuous, up to 30)."""
+        if not 0 <= minutes <= _MAX_WORKING_PERIOD:
+            raise ValueError('working period must be 0..30 minutes')
+        self._uart.write(self._frames['DUTYCYCLE'][minutes])
+
+    def set_duty_cycle(self, minutes):
+        """Set the working period of the sensor and confirm it from the
+        reply frame. With a period of 1 to 30 minutes the sensor sleeps on
+        its own and reports one measurement per period; 0 restores
+        continuous mode.
+
+        Return True if the sensor acknowledged the new period.
+        """
+        self._reply_ready = False
+        self.set_working_period(minutes)
+        if not self._wait_reply(_SDS011_CMDS['DUTYCYCLE']):
+            return False
+        reply = self._reply
+        if reply[3] != _SDS011_CMDS['SET'] or reply[4] != minutes:
+            return False
+        self._duty_cycle = minutes
+        return True
+
+    def get_duty_cycle(self):
+        """Read back the working period of the sensor, in minutes.
+
+        Return None if the sensor does not answer.
+        """
+        self._reply_ready = False
+        self.query_working_period()
+        if not self._wait_reply(_SDS011_CMDS['DUTYCYCLE']):
+            return None
+        self._duty_cycle = self._reply[4]
+        return self._duty_cycle
+
+    def set_target_id(self, device_id):
+        """Send the following commands to this device ID only
+        (0xffff broadcasts).
+        """
+        if device_id == _BROADCAST_ID:
+            self._frames = _BROADCAST_FRAMES
+        else:
+            self._frames = _build_frames(device_id)
+        self._target_id = device_id
+        self._cmd_buf[15] = device_id >> 8
+        self._cmd_buf[16] = device_id & 0xff
+
+    def set_device_id(self, new_id):
+        """Change the device ID stored in the sensor, and address the
+        following commands to the new ID if the device was targeted.
+
+        Return True if the sensor confirmed the new ID.
+        """
+        buf = self._cmd_buf
+        buf[13] = (new_id >> 8) & 0xff
+        buf[14] = new_id & 0xff
+        _set_checksum(buf)
+        self._reply_ready = False
+        self._uart.write(buf)
+        if not self._wait_reply(_SDS011_CMDS['SET_ID']):
+            return False
+        reply = self._reply
+        if ((reply[6] << 8) | reply[7]) != new_id:
+            return False
+        self._device_id = new_id
+        if self._target_id != _BROADCAST_ID:
+            self.set_target_id(new_id)
+        return True
 
     def process_measurement(self, packet):
-        try:
-            *data, checksum, tail = struct.unpack('<HHBBBs', packet)
-            self._pm25 = data[0]/10.0
-            self._pm10 = data[1]/10.0
-            checksum_OK = (checksum == (sum(data) + (data[0]>>8) + (data[1]>>8))  % 256)
-            tail_OK = tail == b'\xab'
-            self._packet_status = True if (checksum_OK and tail_OK) else False
-        except Exception as e:
-            print('Problem decoding packet:', e)
-            sys.print_exception(e)
+        """Validate and decode the 8 bytes following the frame header.
+
+        PM values are only updated when checksum and tail are correct.
+        """
+        checksum = (packet[0] + packet[1] + packet[2] +
+                    packet[3] + packet[4] + packet[5]) & 0xff
+        self._packet_status = checksum == packet[6] and packet[7] == 0xab
+        if self._packet_status:
+            self._pm25 = packet[0] | (packet[1] << 8)
+            self._pm10 = packet[2] | (packet[3] << 8)
+            self._device_id = (packet[4] << 8) | packet[5]
+
+    def _fill(self):
+        """Move every byte waiting in the UART into the ring buffer.
+
+        Return the number of bytes read.
+        """
+        total = 0
+        while self._count < _RING_SIZE:
+            available = self._uart.any()
+            if not available:
+                break
+            tail = (self._head + self._count) & _RING_MASK
+            size = min(available, _RING_SIZE - self._count, _RING_SIZE - tail)
+            n = self._uart.readinto(self._ring_views[tail], size)
+            if not n:
+                break
+            self._count += n
+            total += n
+        return total
+
+    def _consume(self, n):
+        self._head = (self._head + n) & _RING_MASK
+        self._count -= n
+
+    def _decode(self):
+        """Look for a measurement frame in the ring buffer.
+
+        Bytes that can not start a valid frame are dropped one at a time,
+        so the decoder resyncs on the next 0xAA 0xC0 header. Command
+        replies found on the way are kept in the reply buffer.
+        Return True if a measurement frame has been decoded.
+        """
+        ring = self._ring
+        while self._count >= _FRAME_LEN:
+            head = self._head
+            cmd = ring[(head + 1) & _RING_MASK]
+            if (ring[head] == 0xaa and (cmd == 0xc0 or cmd == 0xc5) and
+                    ring[(head + 9) & _RING_MASK] == 0xab):
+                frame = self._frame if cmd == 0xc0 else self._reply
+                for i in range(_FRAME_LEN):
+                    frame[i] = ring[(head + i) & _RING_MASK]
+                if cmd == 0xc0:
+                    self.process_measurement(self._packet)
+                    if self._packet_status:
+                        self._consume(_FRAME_LEN)
+                        return True
+                elif _frame_checksum_ok(frame):
+                    self._reply_ready = True
+                    self._consume(_FRAME_LEN)
+                    continue
+            self._consume(1)
+        return False
+
+    def _wait_reply(self, cmd):
+        """Wait for the reply to a command, decoding any measurement frame
+        received meanwhile. Return True if the reply arrived in time.
+        """
+        deadline = utime.ticks_add(utime.ticks_ms(), _READ_TIMEOUT_MS)
+        while True:
+            self._fill()
+            while self._decode():
+                pass
+            if self._reply_ready and self._reply[2] == cmd:
+                return True
+            if utime.ticks_diff(deadline, utime.ticks_ms()) <= 0:
+                return False
+
+    def frames(self):
+        """Generator yielding the driver once for every measurement frame
+        already received, newest last. It never blocks: iteration stops as
+        soon as the UART has no complete frame left.
+
+        Meant for active reporting mode, where frames arrive on their own.
+        """
+        while True:
+            if self._decode():
+                yield self
+            elif not self._fill():
+                return
+
+    def request(self):
+        """Start a new reading without waiting for it: send a query (query
+        mode only) and arm the response deadline. Follow up with collect().
+        """
+        if self._active:
+            timeout = _ACTIVE_TIMEOUT_MS
+        else:
+            self.query()
+            timeout = _READ_TIMEOUT_MS
+        self._fresh = False
+        self._deadline = utime.ticks_add(utime.ticks_ms(), timeout)
+
+    def collect(self):
+        """Decode what has been received since request(), without blocking.
+        In active mode the newest pushed frame is kept.
+
+        Return True once the measurement is available.
+        """
+        # Same loop as frames(), inlined: read() calls this in a tight loop
+        # and a generator per call would allocate on every iteration
+        while True:
+            if self._decode():
+                self._fresh = True
+                if not self._active:
+                    break
+            elif not self._fill():
+                break
+        return self._fresh
+
+    def timed_out(self):
+        """Return True if the response to request() is overdue."""
+        return utime.ticks_diff(self._deadline, utime.ticks_ms()) <= 0
 
     def read(self):
         """
         Query a new measurement, wait for response and process it.
-        Waits for a response during 512 characters (0.4s at 9600bauds).
-        
-        Return True if a response has been received, False overwise.
-        """
-        #Query measurement
-        self.query()
-
-        #Read measurement
-        #Drops up to 512 characters before giving up finding a measurement pkt...
-        for i in range(512):
-            try:
-                header = self._uart.read(1)
-                if header == b'\xaa':
-                    command = self._uart.read(1)
-
-                    if command == b'\xc0':
-                        packet = self._uart.read(8)
-                        if packet != None:
-                            self.process_measurement(packet)
-                            return True
-            except Exception as e:
-                print('Problem attempting to read:', e)
-                sys.print_exception(e)
-
-        #If we gave up finding a measurement pkt
-        return False
+        Waits for a response during 512 characters (0.55s at 9600bauds),
+        resyncing on the frame header if the line is noisy.
+        In active mode no query is sent: every frame pushed since the last
+        call is consumed and the newest one is kept.
+
+        Return True if a valid response has been received, False overwise.
+        """
+        self.request()
+        while not self.collect():
+            if self.timed_out():
+                #If we gave up finding a measurement pkt
+                return False
+        return True
@@ -1,14 +1,25 @@
 #imports
 from lcd.lcd import LCD1602
-from wifi_functions import connect, disconnect, setup_time
+from wifi_functions import connect, disconnect, setup_time, UTC_OFFSET_S
 from sensors.dht11.dht11 import dht11
 from sensors.sds011.sds011 import sds011
 from mqtt_client.MQTTclient import MQTTclient
+from mqtt_client.connection import ConnectionManager, CONNECTED
+from filters.filters import FilterStage, Hampel
+from measurement import Measurement, READINGS
+from event_bus import EventBus
+from scheduler import Scheduler
+from acquisition import Acquisition, SDS011_TIMING
+from gc_policy import GcPolicy
 from config import SSID, PSWD
+import rtc_state
 
 import time
+import utime
+import machine
+import uasyncio as asyncio
 
-from machine import Pin, Timer, UART, SoftI2C
+from machine import Pin, UART, SoftI2C
 
 
 fila_cero = [2, 6, 9, 11, 12, 15]
@@ -21,18 +32,57 @@ pm10 = bytearray([ 0x00, 0x00, 0x00, 0x00, 0x17, 0x15, 0x15, 0x17])
 pm25 = bytearray([0x00, 0x00, 0x00, 0x1B, 0x0A, 0x1B, 0x11, 0x1B])
 grados_cent = bytearray([ 0x18, 0x18, 0x00, 0x07, 0x04, 0x04, 0x04, 0x07])
 
-global fan_on 
-
 DHT11_PIN = 5 
 SDS011_UART = UART(1, baudrate = 9600, rx = 16, tx = 17)
+# Periodo de trabajo del SDS011 en minutos (1-30). El sensor se despierta y
+# reporta solo una vez por periodo. 0 = encender/apagar el ventilador desde aca
+SDS011_WORKING_PERIOD = 1
 
-def timer_callback(timer):  
-  global read_data  
-  read_data = True
-  
-connect(SSID, PSWD)
-setup_time()
-#disconnect()
+# Periodos de las tareas, en ms
+SAMPLE_PERIOD_MS = 20000        # se estira si el calentamiento no alcanza
+# Apaga el ventilador apenas las lecturas de PM se estabilizan
+ADAPTIVE_WARMUP = True
+CLOCK_PERIOD_MS = 10000
+DISPLAY_PERIOD_MS = 200
+PUBLISH_PERIOD_MS = 500
+KEEPALIVE_PERIOD_MS = 30000
+MQTT_KEEPALIVE_S = 60
+CONNECTION_PERIOD_MS = 500
+MQTT_TIMEOUT_S = 5
+# Cada intento de reconexion bloquea hasta este tiempo
+MQTT_CONNECT_TIMEOUT_S = 1
+# Lecturas por mensaje MQTT y antiguedad maxima del lote (1 = sin lotes)
+MQTT_BATCH_SIZE = 1
+MQTT_BATCH_AGE_MS = 120000
+# Payload binario compacto (ver mqtt_client/decoder.py) en lugar de JSON
+MQTT_BINARY = False
+STATION_ID = 1
+# Lecturas sin publicar (broker caido) guardadas en flash y reenviadas
+MQTT_STORE_PATH = '/pending.log'
+DRAIN_PERIOD_MS = 5000
+# Recolecta la basura solo cuando la memoria libre baja de GC_MIN_FREE
+GC_PERIOD_MS = 1000
+GC_MIN_FREE = 16384
+# QoS 1: hasta MQTT_WINDOW mensajes sin confirmar, reenviados si no llega
+# el PUBACK (0 = sin confirmacion)
+MQTT_QOS = 1
+MQTT_WINDOW = 4
+MQTT_ACK_TIMEOUT_MS = 5000
+# Publica solo cuando un valor cambia mas que su banda muerta
+# (absoluta, relativa) o cada MQTT_HEARTBEAT_MS. None = cada muestra
+MQTT_DEADBAND = {'temp': (0.5, 0),
+                 'hum': (2, 0),
+                 'pm25': (2, 0.1),
+                 'pm10': (2, 0.1)}
+MQTT_HEARTBEAT_MS = 600000
+
+# Modo bajo consumo: cada DEEPSLEEP_PERIOD_S segundos despierta, muestrea,
+# publica y vuelve a deep sleep. Filtros, lecturas sin publicar y el proximo
+# despertar se guardan en la memoria del RTC. No usa el LCD.
+# 0 = estacion siempre despierta
+DEEPSLEEP_PERIOD_S = 0
+# Sin WiFi en este tiempo guarda la lectura y vuelve a dormir
+WIFI_TIMEOUT_MS = 15000
 
 # Datos del servidor MQTT
 mqtt_server = "192.168.100.14"
@@ -41,45 +91,166 @@ topic = b"topic"
 
 
 # instances of observers
-lcd_display = LCD1602(scl=Pin(22), sda=Pin(21), freq=1000, addr=0x3f)
 dht11_sensor = dht11(DHT11_PIN)
 sds011_sensor = sds011(SDS011_UART)
-client = MQTTclient(mqtt_server, client_id, topic)
+client = MQTTclient(mqtt_server, client_id, topic, keepalive=MQTT_KEEPALIVE_S,
+                     batch_size=MQTT_BATCH_SIZE, batch_age_ms=MQTT_BATCH_AGE_MS,
+                     binary=MQTT_BINARY, station_id=STATION_ID,
+                     store_path=MQTT_STORE_PATH, qos=MQTT_QOS,
+                     window=MQTT_WINDOW, ack_timeout_ms=MQTT_ACK_TIMEOUT_MS,
+                     deadband=MQTT_DEADBAND, heartbeat_ms=MQTT_HEARTBEAT_MS,
+                     utc_offset_s=UTC_OFFSET_S)
+# descarta los picos de PM al arrancar el ventilador
+pm_filter = FilterStage({'pm25': Hampel(5, min_deviation=2.0),
+                         'pm10': Hampel(5, min_deviation=2.0)})
 
-#connect mqtt
-client.connect()
+def deepsleep_cycle():
+    # Una muestra por despertar; termina en deep sleep y no vuelve
+    state = rtc_state.load()
+    state.cycles += 1
+    pm_filter.load(state.filters)
+    reading = Measurement()
+    sds011_sensor.add_observer(pm_filter)
+    pm_filter.add_observer(reading)
+    dht11_sensor.add_observer(reading)
 
-# Agregar la pantalla LCD como observador del sensor y del reloj
-dht11_sensor.add_observer(lcd_display)
-sds011_sensor.add_observer(lcd_display)
-dht11_sensor.add_observer(client)
-sds011_sensor.add_observer(client)
+    # el ventilador calienta mientras se conecta el WiFi
+    warmup_end = utime.ticks_add(utime.ticks_ms(), SDS011_TIMING.warmup_ms)
+    sds011_sensor.wake()
+    online = connect(SSID, PSWD, timeout_ms=WIFI_TIMEOUT_MS)
+    if online and not state.time_set:
+        # el RTC conserva la hora durante el deep sleep
+        setup_time()
+        state.time_set = True
+    utime.sleep_ms(max(0, utime.ticks_diff(warmup_end, utime.ticks_ms())))
+    sds011_sensor.read_pm()
+    sds011_sensor.sleep()
+    dht11_sensor.read_temperature()
+
+    now = time.time()
+    # sin hora valida la lectura no tiene marca de tiempo, se descarta
+    if state.time_set and reading.fields & READINGS == READINGS:
+        state.add_pending(now, reading)
+    if not online:
+        print('WiFi no disponible, lecturas pendientes:', len(state.pending))
+    else:
+        try:
+            client.connect(timeout=MQTT_TIMEOUT_S)
+            client.drain()
+            record = Measurement()
+            sent = []
+            for entry in state.pending:
+                timestamp, record.temp, record.hum, record.pm25, record.pm10 = entry
+                inflight = client.inflight
+                # un mensaje por lectura, para saber cual confirma cada PUBACK
+                client.publish(record, timestamp)
+                client.flush()
+                sent.append((entry, client.last_pid if client.inflight > inflight else None))
+            # QoS 1: espera los PUBACK antes de desconectar
+            deadline = utime.ticks_add(utime.ticks_ms(), MQTT_ACK_TIMEOUT_MS)
+            while client.inflight and utime.ticks_diff(deadline, utime.ticks_ms()) > 0:
+                client.poll()
+                utime.sleep_ms(10)
+            # las no confirmadas se reenvian en el proximo despertar
+            state.pending = [entry for entry, pid in sent
+                             if pid is not None and not client.acked(pid)]
+            # latencia desde el despertar (ticks_ms arranca en 0 al bootear)
+            state.wake_ms = utime.ticks_ms()
+            client.publish_metrics({'wake_ms': state.wake_ms,
+                                    'cycles': state.cycles})
+            client.disconnect()
+        except OSError as e:
+            print('MQTT no disponible, lecturas pendientes:', len(state.pending), e)
+    print('wake-to-publish:', state.wake_ms, 'ms')
+
+    state.filters = pm_filter.dump()
+    next_wake = state.next_wake or now
+    if next_wake <= now:
+        # tambien si la hora se acaba de ajustar por NTP
+        next_wake += ((now - next_wake) // DEEPSLEEP_PERIOD_S + 1) * DEEPSLEEP_PERIOD_S
+    state.next_wake = next_wake
+    rtc_state.save(state)
+    disconnect()
+    machine.deepsleep(max(1, next_wake - time.time()) * 1000)
+
+if DEEPSLEEP_PERIOD_S:
+    deepsleep_cycle()
+
+connect(SSID, PSWD)
+setup_time()
+#disconnect()
+
+lcd_display = LCD1602(scl=Pin(22), sda=Pin(21), freq=1000, addr=0x3f)
+# cola entre sensores y observadores lentos (MQTT, LCD)
+bus = EventBus()
+
+#connect mqtt: reconexion con backoff, timeouts y keepalive sin bloquear
+connection = ConnectionManager(client, timeout=MQTT_TIMEOUT_S,
+                               keepalive_ms=KEEPALIVE_PERIOD_MS,
+                               connect_timeout=MQTT_CONNECT_TIMEOUT_S)
 
-#instancia del timer
-timer = Timer(0)
+def on_connection(state):
+    if state == CONNECTED:
+        print('MQTT conectado', connection.metrics())
+        client.publish_metrics(connection.metrics())
+    else:
+        print('MQTT desconectado')
 
-#interrupt config
-timer.init(period=10000, mode=Timer.PERIODIC, callback=timer_callback)
+connection.add_callback(on_connection)
+connection.step()
+
+# ciclo de trabajo del SDS011 manejado por el propio sensor
+sds_duty_cycle = False
+if SDS011_WORKING_PERIOD:
+    sds_duty_cycle = sds011_sensor.set_duty_cycle(SDS011_WORKING_PERIOD)
+    if not sds_duty_cycle:
+        print('SDS011 no confirmo el periodo de trabajo, se usa wake/sleep')
+if not sds_duty_cycle:
+    # el sensor guarda el periodo: volver a modo continuo si quedo uno
+    # de antes o de un intento fallido
+    sds011_sensor.set_duty_cycle(0)
+
+# Agregar la pantalla LCD como observador del sensor y del reloj
+dht11_sensor.add_observer(bus)
+sds011_sensor.add_observer(pm_filter)
+pm_filter.add_observer(bus)
+lcd_queue = bus.add_observer(lcd_display)
+mqtt_queue = bus.add_observer(client, depth=8)
 
 # crear templeate del lcd
 lcd_display.create_templeate(char_position={'fila0': fila_cero, 'fila1': fila_uno},
                              chars={'fila0':char_filacero, 'fila1':char_filauno},
                              char_hex=[hr, pm10, pm25, grados_cent])
 
-read_data =  False
-fan_on = False
+clock = Measurement()
 
-# Simular lectura de temperatura y notificar a los observadores solo cada 5 segundos
-while True:  
+async def duty_cycle_task():
+    # Con ciclo de trabajo el sensor reporta solo, se revisa cada segundo
+    while True:
+        for _ in sds011_sensor.stream():
+            dht11_sensor.read_temperature()
+        await asyncio.sleep_ms(1000)
+
+def clock_job():
     year, month, mday, hour, minute, second, weekday, yearday = time.localtime()
-    if read_data:
-        read_data = False
-        if fan_on:          
-          sds011_sensor.read_pm() 
-          sds011_sensor.sleep()
-          dht11_sensor.read_temperature()
-          fan_on = False                    
-        else:
-          sds011_sensor.wake()
-          fan_on = True          
-        lcd_display.update(hour = hour, minute = minute)
\ No newline at end of file
+    clock.set_clock(hour, minute)
+    lcd_display.update(clock)
+
+scheduler = Scheduler()
+if sds_duty_cycle:
+    scheduler.spawn(duty_cycle_task())
+else:
+    # el DHT11, el LCD y MQTT trabajan mientras calienta el ventilador y
+    # PM se lee apenas termina el calentamiento
+    acquisition = Acquisition(sds011_sensor, dht11_sensor, SAMPLE_PERIOD_MS,
+                              adaptive=ADAPTIVE_WARMUP)
+    scheduler.spawn(acquisition.run())
+scheduler.every(CLOCK_PERIOD_MS, clock_job)
+# un consumidor por observador: el LCD y MQTT no frenan el muestreo
+scheduler.every(DISPLAY_PERIOD_MS, lcd_queue.deliver, 'display')
+scheduler.every(PUBLISH_PERIOD_MS, mqtt_queue.deliver, 'publish')
+scheduler.every(PUBLISH_PERIOD_MS, client.poll, 'batch')
+scheduler.every(DRAIN_PERIOD_MS, client.drain, 'drain')
+scheduler.every(CONNECTION_PERIOD_MS, connection.step, 'connection')
+scheduler.every(GC_PERIOD_MS, GcPolicy(GC_MIN_FREE).step, 'gc')
+scheduler.run()
@@ -0,0 +1,65 @@
+"""Measurement record shared by the sensor wrappers and their observers.
+
+A wrapper owns one Measurement, fills it in place on every reading and
+hands it by reference to each observer's update(). `fields` is a bit mask
+telling which values the current update carries.
+"""
+
+# Bits of Measurement.fields
+TEMP = 0x01
+HUM = 0x02
+PM25 = 0x04
+PM10 = 0x08
+CLOCK = 0x10        # hour and minute
+
+DHT = TEMP | HUM
+PM = PM25 | PM10
+READINGS = DHT | PM
+
+
+class Measurement:
+    __slots__ = ('temp', 'hum', 'pm25', 'pm10', 'hour', 'minute', 'fields')
+
+    def __init__(self):
+        self.temp = None
+        self.hum = None
+        self.pm25 = None
+        self.pm10 = None
+        self.hour = None
+        self.minute = None
+        self.fields = 0
+
+    def set_dht(self, temp, hum):
+        self.temp = temp
+        self.hum = hum
+        self.fields = DHT
+
+    def set_pm(self, pm25, pm10):
+        self.pm25 = pm25
+        self.pm10 = pm10
+        self.fields = PM
+
+    def set_clock(self, hour, minute):
+        self.hour = hour
+        self.minute = minute
+        self.fields = CLOCK
+
+    def merge(self, other):
+        """Copy the values carried by other and add them to fields."""
+        fields = other.fields
+        if fields & TEMP:
+            self.temp = other.temp
+        if fields & HUM:
+            self.hum = other.hum
+        if fields & PM25:
+            self.pm25 = other.pm25
+        if fields & PM10:
+            self.pm10 = other.pm10
+        if fields & CLOCK:
+            self.hour = other.hour
+            self.minute = other.minute
+        self.fields |= fields
+
+    def update(self, measurement):
+        # A Measurement can observe sensors itself, collecting their values
+        self.merge(measurement)
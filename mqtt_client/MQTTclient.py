@@ -1,56 +1,456 @@
 from umqtt.simple import MQTTClient
+from measurement import Measurement, READINGS
+from mqtt_client.store import FlashQueue
 import json
+import ustruct as struct
 import time
+import utime
+
+# Binary payload: one fixed-size record per reading, little endian.
+# version, station id, Unix epoch (s, UTC), temp, hum, pm25, pm10 (x10).
+# Decoded on the consumer side by mqtt_client/decoder.py
+PAYLOAD_VERSION = 1
+_RECORD_FORMAT = '<BHIhhhh'
+_RECORD_SIZE = struct.calcsize(_RECORD_FORMAT)
+_MISSING = -32768
+# MicroPython ports with a 2000 epoch
+_EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+def _scale(value):
+    return _MISSING if value is None else int(round(value * 10))
+
+def _unscale(value):
+    return None if value == _MISSING else value / 10
+
+# QoS 1 control packets
+_PUBLISH_QOS1 = 0x32
+_DUP = 0x08
+_PUBACK = 0x40
 
 class MQTTclient:
     
-    def __init__(self, mqtt_server, client_id, topic):
-        self._client = MQTTClient(client_id, mqtt_server)
+    def __init__(self, mqtt_server, client_id, topic, keepalive=0,
+                 batch_size=1, batch_age_ms=0, binary=False, station_id=0,
+                 store_path=None, store_capacity=2048, qos=0, window=4,
+                 ack_timeout_ms=5000, deadband=None, heartbeat_ms=0,
+                 utc_offset_s=0):
+        # batch_size > 1 buffers readings and sends them as one JSON array,
+        # flushed when batch_size readings are buffered, when the oldest is
+        # batch_age_ms old (if set) or on flush()/disconnect()
+        # binary sends packed records instead of JSON (concatenated when
+        # batched), tagged with station_id. utc_offset_s is how far the
+        # RTC (local time) is ahead of UTC, removed from packed timestamps
+        # store_path keeps the readings that could not be published in a
+        # flash ring log, replayed in order by drain()
+        # qos=1 keeps up to window messages in flight, acknowledged by
+        # PUBACK as they arrive and resent (DUP) after ack_timeout_ms
+        # deadband ({'temp': (absolute, relative), ...}) makes update()
+        # report by exception: a sample is published only when a listed
+        # field moved more than absolute, or relative times its last
+        # reported value, or heartbeat_ms (if set) after the last report
+        self._client = MQTTClient(client_id, mqtt_server, keepalive=keepalive)
         #self.client.connect()        
         self._topic = topic
         
-        self._message = {'temp': None,
-                        'hum': None,
-                        'pm10': None,
-                        'pm25': None}
+        # Values received since the last publish
+        self._record = Measurement()
+        
+        # Built once, refreshed in place before every publish
+        self._payload = {'year': None,
+                         'month': None,
+                         'mday': None,
+                         'hour': None,
+                         'minute':None,
+                         'second':None,
+                         'temp': None,
+                         'hum': None,
+                         'pm10': None,
+                         'pm25': None}
         
-        self._timedata = {'year': None,
-                          'month': None,
-                          'mday': None,
-                          'hour': None,
-                          'minute':None,
-                          'second':None                                                    
-                        }
+        self._batch_size = batch_size
+        self._batch_age_ms = batch_age_ms
+        # Buffered readings: [timestamp, temp, hum, pm25, pm10]
+        self._batch = []
+        self._batch_start = 0
+        self._scratch = Measurement()
+        
+        self._binary = binary
+        self._station_id = station_id
+        self._utc_offset_s = utc_offset_s
+        self._buffer = bytearray(_RECORD_SIZE * max(batch_size, 1))
+        
+        self._online = False
+        # ticks_ms of the last packet sent, for keepalive
+        self._last_activity = utime.ticks_ms()
+        self._store = None
+        if store_path is not None:
+            self._store = FlashQueue(store_path, _RECORD_SIZE, store_capacity)
+            self._store_buf = bytearray(_RECORD_SIZE)
+        
+        self._qos = qos
+        self._window = window
+        self._ack_timeout_ms = ack_timeout_ms
+        # In-flight messages: [packet id, msg, ticks_ms of last send]
+        self._inflight = []
+        # Drain message waiting for its PUBACK: [packet id, readings,
+        # store.dropped when sent]. Its readings stay in the store until then
+        self._draining = None
+        self._header = bytearray(5)
+        self._pid_buf = bytearray(2)
+        self._timeout = None
+        self.retransmits = 0
+        
+        self._deadband = deadband
+        self._heartbeat_ms = heartbeat_ms
+        # Last sample sent by update()
+        self._reported = Measurement()
+        self._reported_at = utime.ticks_ms()
+        self.suppressed = 0
         
     def is_complete(self):        
-        for value in self._message.values():
-            if value is None:
+        return self._record.fields & READINGS == READINGS
+              
+    @property
+    def stored(self):
+        # Readings waiting in the flash log
+        return self._store.count if self._store is not None else 0
+              
+    @property
+    def online(self):
+        return self._online
+
+    @property
+    def last_activity(self):
+        return self._last_activity
+
+    @property
+    def inflight(self):
+        # QoS 1 messages waiting for their PUBACK
+        return len(self._inflight)
+              
+    def connect(self, timeout=None, connect_timeout=None):
+        # timeout (s) bounds every socket operation once connected, and the
+        # connection itself unless connect_timeout (s) is given
+        if connect_timeout is None:
+            connect_timeout = timeout
+        self._client.connect(timeout=connect_timeout)
+        self._client.sock.settimeout(timeout)
+        self._timeout = timeout
+        self._online = True
+        self._last_activity = utime.ticks_ms()
+        # Unacknowledged messages are resent on the next poll()
+        expired = utime.ticks_add(self._last_activity, -self._ack_timeout_ms)
+        for message in self._inflight:
+            message[2] = expired
+    
+    def disconnect(self):
+        self.flush()
+        self._client.disconnect()
+        self._online = False
+
+    def close(self):
+        # Drops a broken connection without talking to the broker
+        self._online = False
+        try:
+            self._client.sock.close()
+        except (OSError, AttributeError):
+            pass
+    
+    def ping(self):
+        # Keepalive. Pending PINGRESP are consumed without blocking
+        self._client.ping()
+        self._last_activity = utime.ticks_ms()
+        self._read_acks()
+
+    def _read_acks(self):
+        # Consumes whatever the broker sent without blocking, releasing the
+        # acknowledged messages and the stored readings they carried
+        client = self._client
+        try:
+            while True:
+                op = client.check_msg()
+                if op is None:
+                    break
+                if op == _PUBACK:
+                    # Remaining length and packet id follow the fixed header
+                    size, high, low = client.sock.read(3)
+                    pid = high << 8 | low
+                    for i, message in enumerate(self._inflight):
+                        if message[0] == pid:
+                            del self._inflight[i]
+                            break
+            self._release_drained()
+        finally:
+            # check_msg() leaves the socket blocking without a timeout
+            client.sock.settimeout(self._timeout)
+
+    def _retransmit(self):
+        now = utime.ticks_ms()
+        for message in self._inflight:
+            if utime.ticks_diff(now, message[2]) >= self._ack_timeout_ms:
+                self._write_publish(message[0], message[1], True)
+                message[2] = now
+                self.retransmits += 1
+
+    def _write_publish(self, pid, msg, dup):
+        # QoS 1 PUBLISH written straight to the umqtt socket, so the
+        # PUBACK is matched later instead of waited for
+        client = self._client
+        header = self._header
+        header[0] = _PUBLISH_QOS1 | _DUP if dup else _PUBLISH_QOS1
+        size = 2 + len(self._topic) + 2 + len(msg)
+        i = 1
+        while size > 0x7F:
+            header[i] = (size & 0x7F) | 0x80
+            size >>= 7
+            i += 1
+        header[i] = size
+        client.sock.write(header, i + 1)
+        client._send_str(self._topic)
+        struct.pack_into('!H', self._pid_buf, 0, pid)
+        client.sock.write(self._pid_buf)
+        client.sock.write(msg)
+        self._last_activity = utime.ticks_ms()
+
+    def _publish_qos1(self, msg):
+        # Returns False, without waiting, if the window is still full after
+        # reading the PUBACKs already received. poll() frees it
+        self._read_acks()
+        if len(self._inflight) >= self._window:
+            return False
+        client = self._client
+        # Packet id 0 is not allowed
+        client.pid = client.pid % 0xFFFF + 1
+        # msg may be a reused buffer, keep a copy until it is acknowledged
+        msg = msg.encode() if isinstance(msg, str) else bytes(msg)
+        self._write_publish(client.pid, msg, False)
+        self._inflight.append([client.pid, msg, self._last_activity])
+        return True
+
+    @property
+    def last_pid(self):
+        # Packet id of the last QoS 1 message sent
+        return self._client.pid
+
+    def acked(self, pid):
+        # False while the message with packet id pid waits for its PUBACK
+        for message in self._inflight:
+            if message[0] == pid:
                 return False
         return True
-              
-    def connect(self):
-        self._client.connect()       
             
-    def update(self, temp=None, hum=None, pm25=None, pm10=None, hour=None, minute=None):        
+    def update(self, measurement):        
         
-        if (temp != None):
-           self._message['temp'] = temp
-           self._message['hum'] = hum
-           #self._client.publish(self._topic, "temp: {} hum: {}".format(temp, hum))
-        if (pm25 != None):
-           self._message['pm25'] = pm25
-           self._message['pm10'] = pm10
-           #self._client.publish(self._topic, "pm2.5: {} pm10: {}".format(pm25, pm10))
+        record = self._record
+        record.merge(measurement)
         
         if self.is_complete():
-           year, month, mday, hour, minute, second, weekday, yearday = time.localtime()
-           self._timedata['hour'] = hour
-           self._timedata['minute'] = minute
-           self._timedata['second'] = second
-           self._timedata['year'] = year
-           self._timedata['month'] = month
-           self._timedata['mday'] = mday
-           self._timedata.update(self._message)
-           jsonmsg = json.dumps(self._timedata)
-           self._client.publish(self._topic, jsonmsg)
-           self._message = {value: None for value in self._message.keys()}
+           if self._deadband is None or self._report_due(record):
+               self.publish(record)
+               self._reported.merge(record)
+               self._reported_at = utime.ticks_ms()
+           else:
+               self.suppressed += 1
+           record.fields = 0
+
+    def _report_due(self, record):
+        reported = self._reported
+        if reported.fields & READINGS != READINGS:
+            return True
+        if (self._heartbeat_ms and
+                utime.ticks_diff(utime.ticks_ms(), self._reported_at) >= self._heartbeat_ms):
+            return True
+        for name, (absolute, relative) in self._deadband.items():
+            value = getattr(record, name)
+            last = getattr(reported, name)
+            if value is None or last is None:
+                if value is not last:
+                    return True
+            elif abs(value - last) > max(absolute, relative * abs(last)):
+                return True
+        return False
+
+    def _document(self, record, timestamp):
+        year, month, mday, hour, minute, second, weekday, yearday = time.localtime(timestamp)
+        payload = self._payload
+        payload['hour'] = hour
+        payload['minute'] = minute
+        payload['second'] = second
+        payload['year'] = year
+        payload['month'] = month
+        payload['mday'] = mday
+        payload['temp'] = record.temp
+        payload['hum'] = record.hum
+        payload['pm10'] = record.pm10
+        payload['pm25'] = record.pm25
+        return json.dumps(payload)
+
+    def _pack(self, buf, offset, record, timestamp):
+        if timestamp is None:
+            timestamp = time.time()
+        struct.pack_into(_RECORD_FORMAT, buf, offset,
+                         PAYLOAD_VERSION, self._station_id,
+                         timestamp + _EPOCH_OFFSET - self._utc_offset_s,
+                         _scale(record.temp), _scale(record.hum),
+                         _scale(record.pm25), _scale(record.pm10))
+
+    def _unpack(self, buf, offset, record):
+        # Returns the timestamp, readings go to record
+        version, station_id, timestamp, temp, hum, pm25, pm10 = \
+            struct.unpack_from(_RECORD_FORMAT, buf, offset)
+        record.temp = _unscale(temp)
+        record.hum = _unscale(hum)
+        record.pm25 = _unscale(pm25)
+        record.pm10 = _unscale(pm10)
+        return timestamp - _EPOCH_OFFSET + self._utc_offset_s
+
+    def _send(self, msg):
+        # Returns False if the broker could not be reached, or the QoS 1
+        # window is full, and there is a store to fall back on
+        try:
+            if self._qos:
+                if not self._publish_qos1(msg):
+                    # Window full: the reading waits in the store instead
+                    if self._store is None:
+                        raise OSError('QoS 1 window full')
+                    return False
+            else:
+                self._client.publish(self._topic, msg)
+                self._last_activity = utime.ticks_ms()
+            return True
+        except OSError as e:
+            if self._store is None:
+                raise
+            print('MQTT publish failed:', e)
+            self.close()
+            return False
+
+    def _store_reading(self, record, timestamp):
+        self._pack(self._store_buf, 0, record, timestamp)
+        self._store.append(self._store_buf)
+
+    def _store_batch(self):
+        # Moves the buffered readings to the store, oldest first
+        record = self._scratch
+        for timestamp, record.temp, record.hum, record.pm25, record.pm10 in self._batch:
+            self._store_reading(record, timestamp)
+        self._batch = []
+
+    def publish(self, record, timestamp=None):
+        # timestamp in seconds since the epoch, defaults to now
+        if timestamp is None:
+            timestamp = time.time()
+        if self._store is not None and (not self._online or self._store.count):
+            # Queued behind the readings already stored or batched, to keep
+            # them in order
+            self._store_batch()
+            self._store_reading(record, timestamp)
+            return
+        if self._batch_size <= 1:
+            if self._binary:
+                self._pack(self._buffer, 0, record, timestamp)
+                msg = self._buffer
+            else:
+                msg = self._document(record, timestamp)
+            if not self._send(msg):
+                self._store_reading(record, timestamp)
+            return
+        if not self._batch:
+            self._batch_start = utime.ticks_ms()
+        self._batch.append([timestamp, record.temp, record.hum,
+                            record.pm25, record.pm10])
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def poll(self):
+        # Flushes the batch once its oldest reading is too old. With QoS 1
+        # also collects PUBACKs and resends the expired messages
+        if self._qos and self._inflight and self._online:
+            try:
+                self._read_acks()
+                self._retransmit()
+            except OSError as e:
+                print('MQTT ack failed:', e)
+                self.close()
+        if (self._batch and self._batch_age_ms and
+                utime.ticks_diff(utime.ticks_ms(), self._batch_start) >= self._batch_age_ms):
+            self.flush()
+
+    def flush(self):
+        # Sends the buffered readings as one JSON array, or as concatenated
+        # binary records. If the publish fails they are moved to the store,
+        # or kept in the batch without one
+        if not self._batch:
+            return
+        record = self._scratch
+        if self._binary:
+            size = len(self._batch) * _RECORD_SIZE
+            if size > len(self._buffer):
+                self._buffer = bytearray(size)
+            offset = 0
+            for timestamp, record.temp, record.hum, record.pm25, record.pm10 in self._batch:
+                self._pack(self._buffer, offset, record, timestamp)
+                offset += _RECORD_SIZE
+            msg = memoryview(self._buffer)[:size]
+        else:
+            documents = []
+            for timestamp, record.temp, record.hum, record.pm25, record.pm10 in self._batch:
+                documents.append(self._document(record, timestamp))
+            msg = '[' + ','.join(documents) + ']'
+        if not self._send(msg):
+            self._store_batch()
+        self._batch = []
+
+    def _release_drained(self):
+        # Removes the readings of the last drain message from the store
+        # once the broker acknowledged it. Returns how many were removed
+        if self._draining is None:
+            return 0
+        pid, n, dropped = self._draining
+        if not self.acked(pid):
+            return 0
+        self._draining = None
+        # The store may have overwritten some of them since
+        n -= min(n, self._store.dropped - dropped)
+        self._store.pop(n)
+        return n
+
+    def drain(self, max_records=16):
+        # Replays up to max_records stored readings, oldest first, as one
+        # message, once the connection is back. With QoS 1 they leave the
+        # store only when the PUBACK arrives, and no other drain message is
+        # sent meanwhile. Returns the number of readings removed
+        store = self._store
+        if store is None:
+            return 0
+        if self._draining is not None:
+            return self._release_drained()
+        if not store.count or not self._online:
+            return 0
+        n = min(store.count, max_records)
+        size = n * _RECORD_SIZE
+        if size > len(self._buffer):
+            self._buffer = bytearray(size)
+        buffer = memoryview(self._buffer)
+        for i in range(n):
+            store.read(i, buffer[i * _RECORD_SIZE:])
+        if self._binary:
+            msg = buffer[:size]
+        else:
+            record = self._scratch
+            documents = []
+            for i in range(n):
+                timestamp = self._unpack(self._buffer, i * _RECORD_SIZE, record)
+                documents.append(self._document(record, timestamp))
+            msg = '[' + ','.join(documents) + ']'
+        if not self._send(msg):
+            return 0
+        if self._qos:
+            self._draining = [self.last_pid, n, store.dropped]
+            return 0
+        store.pop(n)
+        return n
+
+    def publish_metrics(self, metrics):
+        # Station metrics (dict) go to <topic>/metrics
+        self._client.publish(self._topic + b'/metrics', json.dumps(metrics))
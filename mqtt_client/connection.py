@@ -0,0 +1,130 @@
+"""Keeps the MQTTclient connection alive with bounded blocking.
+
+step() is meant to be called periodically (e.g. from the scheduler). Each
+call does at most one bounded operation: a connection attempt once the
+backoff delay has elapsed, or a keepalive ping when the link has been
+idle. The socket calls are blocking, so a step can stall the caller for
+up to connect_timeout seconds while the broker is unreachable (plus the
+DNS lookup when the server is given by name), or timeout seconds for a
+ping.
+"""
+
+import random
+import utime
+
+# Connection states
+DISCONNECTED = 0
+CONNECTED = 1
+
+
+class ConnectionManager:
+    """
+    :param client: The `MQTTclient` to manage.
+    :param timeout: Socket timeout once connected, in seconds.
+    :param connect_timeout: Socket timeout of a connection attempt, in
+        seconds. Kept short: every failed attempt blocks this long.
+    :param keepalive_ms: Idle time after which a ping is sent.
+    :param backoff_ms: First reconnection delay, doubled on every failed
+        attempt up to max_backoff_ms, plus up to jitter (fraction) of it.
+    """
+
+    def __init__(self, client, timeout=5, keepalive_ms=30000,
+                 backoff_ms=1000, max_backoff_ms=60000, jitter=0.25,
+                 connect_timeout=1):
+        self._client = client
+        self._timeout = timeout
+        self._connect_timeout = connect_timeout
+        self._keepalive_ms = keepalive_ms
+        self._backoff_ms = backoff_ms
+        self._max_backoff_ms = max_backoff_ms
+        self._jitter = jitter
+        self._callbacks = []
+
+        self._state = DISCONNECTED
+        self._delay_ms = 0
+        self._next_attempt = utime.ticks_ms()
+        self._lost_at = utime.ticks_ms()
+        self._connected_once = False
+
+        # Metrics
+        self.attempts = 0           # Connection attempts since last connect
+        self.total_attempts = 0
+        self.reconnects = 0
+        self.reconnect_ms = None    # Time from losing the link to reconnect
+
+    @property
+    def state(self):
+        return self._state
+
+    def add_callback(self, callback):
+        """Call callback(state) on every state change."""
+        self._callbacks.append(callback)
+
+    def metrics(self):
+        return {'attempts': self.attempts,
+                'total_attempts': self.total_attempts,
+                'reconnects': self.reconnects,
+                'reconnect_ms': self.reconnect_ms}
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        self._state = state
+        for callback in self._callbacks:
+            try:
+                callback(state)
+            except OSError as e:
+                # e.g. a publish on a link that just dropped: the next
+                # step() sees the client offline and reconnects
+                print('MQTT callback failed:', e)
+                self._client.close()
+
+    def _lost(self):
+        self._client.close()
+        self._lost_at = utime.ticks_ms()
+        self._delay_ms = 0
+        self._next_attempt = self._lost_at
+        self._set_state(DISCONNECTED)
+
+    def _schedule_retry(self):
+        if self._delay_ms:
+            self._delay_ms = min(self._delay_ms * 2, self._max_backoff_ms)
+        else:
+            self._delay_ms = self._backoff_ms
+        jitter = int(self._delay_ms * self._jitter)
+        delay = self._delay_ms + (random.getrandbits(16) % (jitter + 1))
+        self._next_attempt = utime.ticks_add(utime.ticks_ms(), delay)
+
+    def step(self):
+        now = utime.ticks_ms()
+        if self._state == CONNECTED:
+            if not self._client.online:
+                # A publish failed since the last step
+                self._lost()
+            elif utime.ticks_diff(now, self._client.last_activity) >= self._keepalive_ms:
+                try:
+                    self._client.ping()
+                except OSError as e:
+                    print('MQTT ping failed:', e)
+                    self._lost()
+            return
+
+        if utime.ticks_diff(now, self._next_attempt) < 0:
+            return
+        self.attempts += 1
+        self.total_attempts += 1
+        try:
+            self._client.connect(timeout=self._timeout,
+                                 connect_timeout=self._connect_timeout)
+        except OSError as e:
+            print('MQTT connect failed:', e)
+            self._client.close()
+            self._schedule_retry()
+            return
+        if self._connected_once:
+            self.reconnects += 1
+        self._connected_once = True
+        self.reconnect_ms = utime.ticks_diff(utime.ticks_ms(), self._lost_at)
+        self._delay_ms = 0
+        self._set_state(CONNECTED)
+        self.attempts = 0
@@ -0,0 +1,48 @@
+"""Decoder for the binary payloads published by MQTTclient(binary=True).
+
+Runs on the consumer side (CPython or MicroPython). A payload is one or
+more fixed-size records:
+
+0  version    uint8
+1  station id uint16
+3  timestamp  uint32, Unix epoch in seconds (UTC)
+7  temp       int16, degC x 10
+9  hum        int16, % x 10
+11 pm25       int16, ug/m3 x 10
+13 pm10       int16, ug/m3 x 10
+
+Readings equal to -32768 were not available.
+"""
+
+import struct
+
+PAYLOAD_VERSION = 1
+RECORD_FORMAT = '<BHIhhhh'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+_MISSING = -32768
+
+
+def _unscale(value):
+    return None if value == _MISSING else value / 10
+
+
+def decode(payload):
+    """Return the list of readings in payload, as dicts with the keys
+    version, station, timestamp, temp, hum, pm25 and pm10.
+    """
+    if len(payload) % RECORD_SIZE:
+        raise ValueError('payload size is not a multiple of {}'.format(RECORD_SIZE))
+    readings = []
+    for offset in range(0, len(payload), RECORD_SIZE):
+        version, station, timestamp, temp, hum, pm25, pm10 = \
+            struct.unpack_from(RECORD_FORMAT, payload, offset)
+        if version != PAYLOAD_VERSION:
+            raise ValueError('unsupported payload version {}'.format(version))
+        readings.append({'version': version,
+                         'station': station,
+                         'timestamp': timestamp,
+                         'temp': _unscale(temp),
+                         'hum': _unscale(hum),
+                         'pm25': _unscale(pm25),
+                         'pm10': _unscale(pm10)})
+    return readings
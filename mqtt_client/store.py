@@ -0,0 +1,95 @@
+"""Persistent ring log of fixed-size records on the flash filesystem.
+
+The file holds a small header followed by `capacity` record slots:
+
+0  magic        b'PQL1'
+4  record size  uint16
+6  capacity     uint16
+8  head         uint32, slot of the oldest record
+12 count        uint32, number of records stored
+
+Appending writes one slot and the header, so it is O(1) and every slot is
+rewritten at the same rate. When the log is full the oldest record is
+dropped.
+"""
+
+import ustruct as struct
+
+_MAGIC = b'PQL1'
+_HEADER_FORMAT = '<4sHHII'
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+
+class FlashQueue:
+
+    def __init__(self, path, record_size, capacity):
+        self._record_size = record_size
+        self._capacity = capacity
+        self._head = 0
+        self._count = 0
+        self.dropped = 0
+        self._header = bytearray(_HEADER_SIZE)
+        try:
+            self._file = open(path, 'r+b')
+            if not self._load_header():
+                self._write_header()
+        except OSError:
+            self._file = open(path, 'w+b')
+            self._write_header()
+
+    @property
+    def count(self):
+        return self._count
+
+    def _load_header(self):
+        self._file.seek(0)
+        if self._file.readinto(self._header) != _HEADER_SIZE:
+            return False
+        magic, record_size, capacity, head, count = struct.unpack(
+            _HEADER_FORMAT, self._header)
+        if (magic != _MAGIC or record_size != self._record_size or
+                capacity != self._capacity or head >= capacity or
+                count > capacity):
+            # Unknown or resized log: start over
+            return False
+        self._head = head
+        self._count = count
+        return True
+
+    def _write_header(self):
+        struct.pack_into(_HEADER_FORMAT, self._header, 0, _MAGIC,
+                         self._record_size, self._capacity,
+                         self._head, self._count)
+        self._file.seek(0)
+        self._file.write(self._header)
+        self._file.flush()
+
+    def _seek(self, index):
+        slot = (self._head + index) % self._capacity
+        self._file.seek(_HEADER_SIZE + slot * self._record_size)
+
+    def append(self, record):
+        """Store the first record_size bytes of record."""
+        if self._count == self._capacity:
+            self._head = (self._head + 1) % self._capacity
+            self._count -= 1
+            self.dropped += 1
+        self._seek(self._count)
+        self._file.write(memoryview(record)[:self._record_size])
+        self._count += 1
+        self._write_header()
+
+    def read(self, index, buf):
+        """Read the index-th oldest record into buf."""
+        self._seek(index)
+        self._file.readinto(memoryview(buf)[:self._record_size])
+
+    def pop(self, n):
+        """Drop the n oldest records, once they have been delivered."""
+        n = min(n, self._count)
+        self._head = (self._head + n) % self._capacity
+        self._count -= n
+        self._write_header()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,64 @@
+"""Station state kept in RTC memory across deep sleep.
+
+The RTC slow memory survives machine.deepsleep() but not a power cycle or
+a hard reset, so the state is only trusted after a deep sleep wake-up.
+"""
+
+import json
+import machine
+
+_VERSION = 2
+MAX_PENDING = 8     # Readings kept while the broker is unreachable
+
+
+class RtcState:
+
+    def __init__(self):
+        # True when the state was restored after a deep sleep wake-up
+        self.resumed = False
+        # True once the RTC was set from NTP
+        self.time_set = False
+        self.filters = {}
+        # Unpublished readings: [epoch, temp, hum, pm25, pm10]
+        self.pending = []
+        # Epoch of the next scheduled wake-up
+        self.next_wake = None
+        # Wake-to-publish latency of the last cycle, in ms
+        self.wake_ms = None
+        self.cycles = 0
+
+    def add_pending(self, timestamp, record):
+        self.pending.append([timestamp, record.temp, record.hum,
+                             record.pm25, record.pm10])
+        if len(self.pending) > MAX_PENDING:
+            self.pending.pop(0)
+
+
+def load():
+    state = RtcState()
+    if machine.reset_cause() != machine.DEEPSLEEP_RESET:
+        return state
+    try:
+        data = json.loads(machine.RTC().memory())
+    except ValueError:
+        return state
+    if data.get('v') != _VERSION:
+        return state
+    state.resumed = True
+    state.time_set = data['time_set']
+    state.filters = data['filters']
+    state.pending = data['pending']
+    state.next_wake = data['next_wake']
+    state.wake_ms = data['wake_ms']
+    state.cycles = data['cycles']
+    return state
+
+
+def save(state):
+    machine.RTC().memory(json.dumps({'v': _VERSION,
+                                     'time_set': state.time_set,
+                                     'filters': state.filters,
+                                     'pending': state.pending,
+                                     'next_wake': state.next_wake,
+                                     'wake_ms': state.wake_ms,
+                                     'cycles': state.cycles}))
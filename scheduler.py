@@ -0,0 +1,67 @@
+"""Cooperative scheduler built on uasyncio.
+
+Each job runs as its own task with its own period. Between deadlines the
+tasks sleep in uasyncio, which leaves the CPU idle instead of spinning in
+a busy loop.
+"""
+
+import uasyncio as asyncio
+import utime
+
+
+class Job:
+
+    def __init__(self, name, period_ms, func):
+        self.name = name
+        self.period_ms = period_ms
+        self.func = func
+        self.runs = 0
+        # Deadlines missed because a run took longer than the period
+        self.overruns = 0
+
+
+class Scheduler:
+
+    def __init__(self):
+        self._jobs = []
+        self._coros = []
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    def every(self, period_ms, func, name=None):
+        """Call func() every period_ms milliseconds."""
+        job = Job(name or func.__name__, period_ms, func)
+        self._jobs.append(job)
+        return job
+
+    def spawn(self, coro):
+        """Run a coroutine as one more task when the scheduler starts."""
+        self._coros.append(coro)
+
+    async def _periodic(self, job):
+        deadline = utime.ticks_ms()
+        while True:
+            try:
+                job.func()
+            except Exception as e:
+                print('Job {} failed:'.format(job.name), e)
+            job.runs += 1
+            deadline = utime.ticks_add(deadline, job.period_ms)
+            delay = utime.ticks_diff(deadline, utime.ticks_ms())
+            if delay < 0:
+                # Skip the missed deadlines instead of running in a burst
+                job.overruns += 1
+                deadline = utime.ticks_ms()
+                delay = 0
+            await asyncio.sleep_ms(delay)
+
+    async def _main(self):
+        tasks = [asyncio.create_task(self._periodic(job)) for job in self._jobs]
+        tasks += [asyncio.create_task(coro) for coro in self._coros]
+        await asyncio.gather(*tasks)
+
+    def run(self):
+        """Start every task and run them forever."""
+        asyncio.run(self._main())
@@ -1,11 +1,37 @@
 #libraries from dht
 from dht import DHT11
+from measurement import Measurement
+import utime
+
+_MIN_INTERVAL_MS = 1000     # DHT11 can not be sampled faster than this
+_BACKOFF_MS = 1000          # First wait after a failed measure
+_MAX_BACKOFF_MS = 16000
 
 class dht11:
     
-    def __init__(self, pin):
+    def __init__(self, pin, min_interval_ms=_MIN_INTERVAL_MS):
         self._observers = set()
         self._dht_sensor = DHT11(pin)         
+        self._measurement = Measurement()
+        self._min_interval_ms = min_interval_ms
+
+        # Last good reading and when it was taken (ticks_ms)
+        self._temperature = None
+        self._humidity = None
+        self._timestamp = None
+
+        self._next_measure = utime.ticks_ms()
+        self._backoff_ms = 0
+        self._errors = 0
+
+    @property
+    def timestamp(self):
+        # ticks_ms of the last good reading, None before the first one
+        return self._timestamp
+
+    @property
+    def errors(self):
+        return self._errors
 
     def add_observer(self, observer):
         self._observers.add(observer)
@@ -13,14 +39,40 @@ class dht11:
     def remove_observer(self, observer):
         self._observers.remove(observer)
 
+    def measure(self):
+        # Returns the last good (temperature, humidity). The sensor is only
+        # sampled once the minimum interval has elapsed; after a failed
+        # measure the next attempt is delayed with a bounded exponential
+        # backoff instead of raising.
+        now = utime.ticks_ms()
+        if utime.ticks_diff(now, self._next_measure) >= 0:
+            try:
+                self._dht_sensor.measure()
+            except OSError:
+                self._errors += 1
+                self._backoff_ms = min(self._backoff_ms * 2 or _BACKOFF_MS,
+                                       _MAX_BACKOFF_MS)
+                self._next_measure = utime.ticks_add(now, self._backoff_ms)
+            else:
+                self._temperature = self._dht_sensor.temperature()
+                self._humidity = self._dht_sensor.humidity()
+                self._timestamp = now
+                self._backoff_ms = 0
+                self._next_measure = utime.ticks_add(now,
+                                                     self._min_interval_ms)
+        return self._temperature, self._humidity
+
     def read_temperature(self):
-        self._dht_sensor.measure()
-        temperature = self._dht_sensor.temperature()
-        humidity = self._dht_sensor.humidity()
+        temperature, humidity = self.measure()
+        if temperature is None:
+            # No good reading yet
+            return False
         
         self._notify_observers(temperature, humidity)
+        return True
 
     def _notify_observers(self, temperature, humidity):        
+        measurement = self._measurement
+        measurement.set_dht(temperature, humidity)
         for observer in self._observers:
-            observer.update(temp = temperature, hum = humidity)
-            
\ No newline at end of file
+            observer.update(measurement)
@@ -1,13 +1,68 @@
 #libraries from sds
 from sds011 import SDS011
 from machine import UART
+from measurement import Measurement
+import utime
+
+# The SDS011 refreshes its measurement once per second
+_QUERY_INTERVAL_MS = 1000
+
+class _Convergence:
+    # Length of the current run of frames agreeing with the previous one
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pm25 = None
+        self.pm10 = None
+        self.stable = 0
+
+    def add(self, pm25, pm10, tolerance, rel_tolerance):
+        if (self.pm25 is not None and
+                abs(pm25 - self.pm25) <= max(tolerance, rel_tolerance * pm25) and
+                abs(pm10 - self.pm10) <= max(tolerance, rel_tolerance * pm10)):
+            self.stable += 1
+        else:
+            self.stable = 1
+        self.pm25 = pm25
+        self.pm10 = pm10
 
 class sds011:
     
-    def __init__(self, uart):
+    def __init__(self, uart, active=False, device_ids=None):
+        # uart can be a single UART or a list of them, one per SDS011 unit.
+        # device_ids optionally addresses commands to each unit's own ID.
         self._observers = set()
-        self._sds_sensor = SDS011(uart)
+        self._measurement = Measurement()
+        uarts = uart if isinstance(uart, (list, tuple)) else (uart,)
+        if device_ids is None:
+            device_ids = (None,) * len(uarts)
+        self._sensors = tuple(SDS011(u, active, device_id)
+                              for u, device_id in zip(uarts, device_ids))
+        self._sds_sensor = self._sensors[0]
+        self._active = active
+        self._pending = False
+
+        # Adaptive warm-up
+        self._trackers = tuple(_Convergence() for _ in self._sensors)
+        self._warming = False
+        self._warmup_start = 0
+        self._warmup_args = None
+        # Query mode: units waiting for an answer, and when to query next
+        self._awaiting = [False] * len(self._sensors)
+        self._query_at = 0
+        self._warmup_ms = None
  
+    @property
+    def sensors(self):
+        return self._sensors
+
+    @property
+    def warmup_ms(self):
+        # Fan-on time used by the last adaptive read
+        return self._warmup_ms
+
     def add_observer(self, observer):
         self._observers.add(observer)
 
@@ -15,18 +70,165 @@ class sds011:
         self._observers.remove(observer)
 
     def read_pm(self):
-        self._sds_sensor.read()
-        pm25 = self._sds_sensor.pm25
-        pm10 = self._sds_sensor.pm10
+        # Blocking read: waits until every unit answered or timed out
+        self.request_pm()
+        result = None
+        while result is None:
+            result = self.poll_pm()
+        return result
+
+    def request_pm(self):
+        # Query every unit first and collect the answers afterwards with
+        # poll_pm(), so several sensors take about as long as one.
+        # In active mode no query is sent, the newest pushed frame is used
+        for sensor in self._sensors:
+            sensor.request()
+        self._pending = True
+
+    def poll_pm(self):
+        # Non-blocking: returns None while a unit may still answer, then
+        # notifies the observers and returns True, or False if no unit
+        # answered before its deadline. Partial frames stay buffered in
+        # the driver for the next poll.
+        if not self._pending:
+            return False
+        pending = False
+        for sensor in self._sensors:
+            if not sensor.collect() and not sensor.timed_out():
+                pending = True
+        if pending:
+            return None
+        self._pending = False
+        return self._notify_average()
+
+    def read_pm_adaptive(self, count=3, tolerance=1.0, rel_tolerance=0.05,
+                         max_warmup_ms=30000):
+        # Blocking version of start_adaptive()/poll_adaptive()
+        self.start_adaptive(count, tolerance, rel_tolerance, max_warmup_ms)
+        result = None
+        while result is None:
+            utime.sleep_ms(100)
+            result = self.poll_adaptive()
+        return result
+
+    def start_adaptive(self, count=3, tolerance=1.0, rel_tolerance=0.05,
+                       max_warmup_ms=30000):
+        # Wake the fan and stream frames until count consecutive PM2.5 and
+        # PM10 values agree within tolerance (ug/m3) or rel_tolerance
+        # (fraction of the value), or until max_warmup_ms.
+        # Units in query mode stay in it and are queried once per second,
+        # the reporting mode is a setting stored by the sensor
+        self.wake()
+        for i, tracker in enumerate(self._trackers):
+            tracker.reset()
+            self._awaiting[i] = False
+        self._warmup_args = (count, tolerance, rel_tolerance, max_warmup_ms)
+        self._warmup_start = utime.ticks_ms()
+        self._query_at = self._warmup_start
+        self._warming = True
+
+    def poll_adaptive(self):
+        # Non-blocking: returns None while warming up, then notifies the
+        # converged (or last, when the cap is hit) values and returns True,
+        # or False if no frame arrived at all. The fan is left running.
+        if not self._warming:
+            return False
+        count, tolerance, rel_tolerance, max_warmup_ms = self._warmup_args
+        now = utime.ticks_ms()
+        query = utime.ticks_diff(now, self._query_at) >= 0
+        if query:
+            self._query_at = utime.ticks_add(now, _QUERY_INTERVAL_MS)
+        converged = True
+        for i, sensor in enumerate(self._sensors):
+            tracker = self._trackers[i]
+            if sensor.active:
+                for _ in sensor.frames():
+                    tracker.add(sensor.pm25, sensor.pm10, tolerance, rel_tolerance)
+            else:
+                if self._awaiting[i]:
+                    if sensor.collect():
+                        tracker.add(sensor.pm25, sensor.pm10, tolerance, rel_tolerance)
+                        self._awaiting[i] = False
+                    elif sensor.timed_out():
+                        self._awaiting[i] = False
+                if query and not self._awaiting[i]:
+                    sensor.request()
+                    self._awaiting[i] = True
+            if tracker.stable < count:
+                converged = False
+        elapsed = utime.ticks_diff(now, self._warmup_start)
+        if not converged and elapsed < max_warmup_ms:
+            return None
+
+        self._warming = False
+        self._warmup_ms = elapsed
+        return self._notify_average(self._trackers)
+
+    def _notify_average(self, trackers=None):
+        # Redundant units are averaged. Without trackers, units that
+        # answered the last request are used; otherwise units whose
+        # tracker got at least one frame.
+        count = 0
+        pm25 = 0.0
+        pm10 = 0.0
+        for i, sensor in enumerate(self._sensors):
+            if sensor.fresh if trackers is None else trackers[i].stable:
+                count += 1
+                pm25 += sensor.pm25
+                pm10 += sensor.pm10
+        if not count:
+            return False
        
-        self._notify_observers(pm25, pm10)
+        self._notify_observers(pm25 / count, pm10 / count)
+        return True
+
+    def stream(self):
+        # Active mode: notify observers once per pushed frame, without
+        # blocking when no frame is pending
+        for sds_sensor in self._sensors:
+            for sensor in sds_sensor.frames():
+                self._notify_observers(sensor.pm25, sensor.pm10)
+                yield sensor
+
+    def set_active(self, active):
+        for sensor in self._sensors:
+            if active:
+                sensor.set_reporting_mode_active()
+            else:
+                sensor.set_reporting_mode_query()
+
+    def set_duty_cycle(self, minutes):
+        # Let the sensor run its own working period (1-30 min) and push one
+        # frame per period, consumed with stream(). 0 = continuous, back in
+        # the reporting mode given to the constructor. The sensor keeps
+        # both settings in its memory: they are read back first and only
+        # written when they change
+        active = True if minutes else self._active
+        confirmed = True
+        for sensor in self._sensors:
+            # A sensor on a working period, or left asleep before a
+            # reboot, does not answer until woken
+            sensor.wake()
+            if sensor.get_reporting_mode() != active:
+                if active:
+                    sensor.set_reporting_mode_active()
+                else:
+                    sensor.set_reporting_mode_query()
+            if sensor.get_duty_cycle() == minutes:
+                continue
+            confirmed = sensor.set_duty_cycle(minutes) and confirmed
+        return confirmed
         
     def wake(self):
-        self._sds_sensor.wake()
+        for sensor in self._sensors:
+            sensor.wake()
     
     def sleep(self):
-        self._sds_sensor.sleep()
+        for sensor in self._sensors:
+            sensor.sleep()
 
     def _notify_observers(self, pm25, pm10):        
+        measurement = self._measurement
+        measurement.set_pm(pm25, pm10)
         for observer in self._observers:
-            observer.update(pm25 = pm25, pm10 = pm10)
\ No newline at end of file
+            observer.update(measurement)
@@ -3,13 +3,21 @@ import time
 
 station = network.WLAN(network.STA_IF)
 
-def connect(ssid, pswd):
+# The RTC keeps local time: UTC-3
+UTC_OFFSET_S = -3 * 3600
+
+def connect(ssid, pswd, timeout_ms=None):
+    # Returns False if not connected within timeout_ms (None waits forever)
     station.active(True)
     station.connect(ssid, pswd)
+    start = time.ticks_ms()
     while not station.isconnected():
-        pass
+        if timeout_ms is not None and time.ticks_diff(time.ticks_ms(), start) >= timeout_ms:
+            return False
+        time.sleep_ms(50)
     time.sleep(2)
     print(station.ifconfig())
+    return True
     
 def disconnect():
     if station.active():
@@ -23,9 +31,7 @@ def setup_time():
     (year, month, day, weekday, hours, minutes, seconds, subseconds) = rtc.datetime()
 
     sec = ntptime.time()
-    timezone_hour = -3
-    timezone_sec = timezone_hour * 3600
-    sec = int(sec + timezone_sec)
+    sec = int(sec + UTC_OFFSET_S)
     
     (year, month, day, hours, minutes, seconds, weekday, yearday) = time.localtime(sec)
     